@@ -1,13 +1,22 @@
+import uuid
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Output, State, Input
+from dash.exceptions import PreventUpdate
 
 import plotly.graph_objs as go
 import numpy as np
-from numba import jit
 from textwrap import dedent as d
 
+from MandelBrotEngine import (mandelbrot_set, progressive_mandelbrot_set, julia_set, JULIA_EXTENT, ResumableView,
+                              ReprojectedView)
+from MandelBrotTiles import render_tiles, render_tiles_progressive
+from MandelBrotDeepZoom import deep_mandelbrot_set, needs_deep_zoom
+from MandelBrotImage import layout_image
+from RenderService import RenderService
+
 styles = {
     'pre': {
         'border': 'thin lightgrey solid',
@@ -20,165 +29,320 @@ app.config['suppress_callback_exceptions'] = True
 
 #######################################################################################################################
 
+# How zoom requests are rendered: 'direct' computes every pixel with mandelbrot_set, 'tiles'
+# assembles the view from the quadtree tile cache, 'resumable' keeps the per-pixel escape state of
+# the current viewport so that moving the iterations slider only iterates what changed, 'reproject'
+# copies the samples shared with the previous frame so that pans only compute the newly exposed
+# strips. 'tiles' snaps every pixel to the nearest sample of the tile lattice, up to sqrt(2) coarser
+# than the pixels, and so changes a few percent of the counts, the other modes give the counts of
+# mandelbrot_set.
+RENDER_MODE = 'direct'
 
-@jit
-def mandelbrot(c, maxiter, threshold=2):
-    z = c
-    for n in range(maxiter):
-        if abs(z) > threshold:
-            return n
-        z = z * z + c
-    return 0
+resumable_view = ResumableView()
+reprojected_view = ReprojectedView()
 
 
-@jit
-def mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500):
-    r1 = np.linspace(xmin, xmax, width)
-    r2 = np.linspace(ymin, ymax, height)
-    n3 = np.empty((width, height))
-    for i in range(width):
-        for j in range(height):
-            n3[i, j] = mandelbrot(r1[i] + 1j*r2[j], maxiter)
-    return r1, r2, n3
+def render_view(xmin, xmax, ymin, ymax, maxiter=250, is_cancelled=None):
+    # Past float64 resolution every mode switches to the perturbation engine
+    if needs_deep_zoom(xmin, xmax, ymin, ymax):
+        return deep_mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+    if RENDER_MODE == 'tiles':
+        return render_tiles(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+    if RENDER_MODE == 'resumable':
+        return resumable_view.render(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+    if RENDER_MODE == 'reproject':
+        return reprojected_view.render(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+    return mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
 
-#######################################################################################################################
 
+# The 'tiles' and 'direct' modes first show a coarse preview of a new view and refine it in passes
+# (see PREVIEW_STRIDES), computing every sample once
+PROGRESSIVE = True
 
-x, y, z = mandelbrot_set(-2.0, 0.5, -1.25, 1.25)
-trace = go.Heatmap(x=x,
-                   y=y,
-                   z=z.T)
 
-data = [trace]
+def render_passes(xmin, xmax, ymin, ymax, maxiter=250, is_cancelled=None):
+    if PROGRESSIVE and not needs_deep_zoom(xmin, xmax, ymin, ymax):
+        if RENDER_MODE == 'tiles':
+            return render_tiles_progressive(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+        if RENDER_MODE == 'direct':
+            return progressive_mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)
+    return [render_view(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=is_cancelled)]
 
-layout = go.Layout(
-    title='Mandelbrot Plot',
-    width=1250,
-    height=1250,
-    xaxis = dict(
-    ),
-    yaxis = dict(
-      scaleanchor = "x",
-    ),
-)
 
-fig = go.Figure(data=data, layout=layout)
+# How renders are shipped to the browser: 'image' colors the counts on the server and sends them as
+# a palette PNG layout image, 'heatmap' sends the counts themselves in a go.Heatmap.
+PAYLOAD = 'image'
 
-################################################################################
+# Layout images do not fire click events, so the browser lays a transparent CLICK_GRID x CLICK_GRID
+# heatmap over image figures, the way clicks were always picked up, and it reports the point
+# clicked for Julia mode. One cell per pixel of the default figure puts the c of a click within
+# half a pixel of the point clicked. The grid is built by ADD_CLICK_GRID in the browser, so that
+# it is not sent with every pass of a render.
+CLICK_GRID = 1250
+
+ADD_CLICK_GRID = """
+function(figure) {
+    if (!figure) {
+        return window.dash_clientside.no_update;
+    }
+    var layout = figure.layout || {};
+    if (!layout.images || !layout.images.length) {
+        return figure;
+    }
+    var n = %d, x = layout.xaxis.range, y = layout.yaxis.range;
+    var xs = new Array(n), ys = new Array(n), z = new Array(n);
+    for (var k = 0; k < n; k++) {
+        xs[k] = x[0] + (x[1] - x[0]) * k / (n - 1);
+        ys[k] = y[0] + (y[1] - y[0]) * k / (n - 1);
+        z[k] = new Array(n).fill(0);
+    }
+    var grid = {type: 'heatmap', x: xs, y: ys, z: z, opacity: 0, showscale: false, hoverinfo: 'x+y'};
+    return Object.assign({}, figure, {data: [grid].concat(figure.data || [])});
+}
+""" % CLICK_GRID
+
+
+def make_figure(x, y, z, title='Mandelbrot Plot', size=1250):
+    # z=None gives the axes alone
+    if z is None:
+        data = []
+        images = []
+    elif PAYLOAD == 'image':
+        data = []
+        images = [layout_image(x, y, z)]
+    else:
+        data = [go.Heatmap(x=x,
+                           y=y,
+                           z=z.T)]
+        images = []
+
+    layout = go.Layout(
+        title=title,
+        width=size,
+        height=size,
+        images=images,
+        xaxis = dict(
+          range = [x[0], x[-1]],
+          showgrid = False,
+          zeroline = False,
+        ),
+        yaxis = dict(
+          range = [y[0], y[-1]],
+          scaleanchor = "x",
+          showgrid = False,
+          zeroline = False,
+        ),
+    )
+
+    return go.Figure(data=data, layout=layout)
+
+
+def render_job(job):
+    # Publishes every intermediate pass, the last one is the result of the job. Figures are passed
+    # on as dicts, which the shared session state pickles a hundred times faster than go.Figure.
+    xmin, xmax, ymin, ymax, maxiter = job.params
+    figure = None
+    for x, y, z in render_passes(xmin, xmax, ymin, ymax, maxiter=maxiter, is_cancelled=job.is_cancelled):
+        if figure is not None:
+            job.publish(figure)
+        figure = make_figure(x, y, z).to_dict()
+    return figure
+
+
+# Zooms are rendered in the background, a newer request of the same browser session cancels the
+# render of the previous one. The page polls for the result every POLL_INTERVAL milliseconds. The
+# session state is shared with the other server processes through RenderService.RENDER_DIR, so
+# submits and polls may reach any gunicorn worker.
+render_service = RenderService(render_job)
+POLL_INTERVAL = 100
+
+HOME_VIEW = [-2.0, 0.5, -1.25, 1.25]
+
+# Julia mode: clicking a point c of the Mandelbrot plot renders the Julia set of c below it
+JULIA_SIZE = 750
+
+
+def view_from_relayout(relayoutData, view):
+    # Axis ranges after a zoom or pan, the home view after autoscale and the unchanged view for
+    # relayout events that do not move the axes
+    view = list(view or HOME_VIEW)
+    if not relayoutData or 'xaxis.autorange' in relayoutData:
+        return list(HOME_VIEW)
+    for axis, offset in (('xaxis', 0), ('yaxis', 2)):
+        if axis + '.range' in relayoutData:
+            view[offset:offset + 2] = relayoutData[axis + '.range']
+        elif axis + '.range[0]' in relayoutData:
+            view[offset:offset + 2] = [relayoutData[axis + '.range[0]'], relayoutData[axis + '.range[1]']]
+    return view
+
+#######################################################################################################################
+
+
+# Nothing is rendered at import. Pages start with the empty axes of the home view and the initial
+# call of display_selected_data renders it through the render service, from the tile store when
+# another process already did.
+fig = make_figure(np.array(HOME_VIEW[:2]), np.array(HOME_VIEW[2:]), None)
+julia_fig = make_figure(np.array([-JULIA_EXTENT, JULIA_EXTENT]), np.array([-JULIA_EXTENT, JULIA_EXTENT]), None,
+                        title='Click the Mandelbrot plot for its Julia set', size=JULIA_SIZE)
 
-app.layout = html.Div([
 ################################################################################
-    # Title
-    html.H2('Zoom Application',
-                style={
-                    'position': 'relative',
-                    'top': '0px',
-                    'left': '10px',
-                    'font-family': 'Dosis',
-                    'display': 'inline',
-                    'font-size': '4.0rem',
-                    'color': '#4D637F'
-                }),
-        html.H2('for',
-                style={
-                    'position': 'relative',
-                    'top': '0px',
-                    'left': '20px',
-                    'font-family': 'Dosis',
-                    'display': 'inline',
-                    'font-size': '2.0rem',
-                    'color': '#4D637F'
-                }),
-        html.H2('MandelBrot',
-                style={
-                    'position': 'relative',
-                    'top': '0px',
-                    'left': '27px',
-                    'font-family': 'Dosis',
-                    'display': 'inline',
-                    'font-size': '4.0rem',
-                    'color': '#4D637F'
-                }),
 
+
+def serve_layout():
+    # Evaluated per page load so that every browser session gets its own render queue slot
+    return html.Div([
     ################################################################################
-    html.Br(),
-
-    html.Div([
-
-        dcc.Graph(
-            id='graph',
-            figure=fig
-                ),
-
-        dcc.Slider(
-            id='iterations',
-            min=0,
-            max=500,
-            marks={
-                0: {'label':     '0'},
-                50: {'label':    '50'},
-                100: {'label':   '100'},
-                150: {'label':   '150'},
-                200: {'label':   '200'},
-                250: {'label':   '250'},
-                300: {'label':   '300'},
-                350: {'label':   '350'},
-                400: {'label':   '400'},
-                450: {'label':   '450'},
-                500: {'label':   '500'},
-            },
-            value=250,
-        ),
+        # Title
+        html.H2('Zoom Application',
+                    style={
+                        'position': 'relative',
+                        'top': '0px',
+                        'left': '10px',
+                        'font-family': 'Dosis',
+                        'display': 'inline',
+                        'font-size': '4.0rem',
+                        'color': '#4D637F'
+                    }),
+            html.H2('for',
+                    style={
+                        'position': 'relative',
+                        'top': '0px',
+                        'left': '20px',
+                        'font-family': 'Dosis',
+                        'display': 'inline',
+                        'font-size': '2.0rem',
+                        'color': '#4D637F'
+                    }),
+            html.H2('MandelBrot',
+                    style={
+                        'position': 'relative',
+                        'top': '0px',
+                        'left': '27px',
+                        'font-family': 'Dosis',
+                        'display': 'inline',
+                        'font-size': '4.0rem',
+                        'color': '#4D637F'
+                    }),
+
+        ################################################################################
+        html.Br(),
 
-        # html.Div([
-        #     dcc.Markdown(d("""
-        #         **Zoom and Relayout Data**
-        #
-        #         Click and drag on the graph to zoom or click on the zoom
-        #         buttons in the graph's menu bar.
-        #         Clicking on legend items will also fire
-        #         this event.
-        #     """)),
-        #     html.Pre(id='relayout-data', style=styles['pre']),
-        # ], className='three columns')
-        #
-        #     ])
+        html.Div([
+
+            dcc.Graph(
+                id='graph',
+                figure=fig
+                    ),
+
+            dcc.Store(id='session', data=str(uuid.uuid4())),
+            dcc.Store(id='view', data=HOME_VIEW),
+            dcc.Store(id='render-job'),
+            dcc.Store(id='render-figure'),
+            dcc.Interval(id='render-poll', interval=POLL_INTERVAL, disabled=True),
+
+            dcc.Slider(
+                id='iterations',
+                min=0,
+                max=500,
+                marks={
+                    0: {'label':     '0'},
+                    50: {'label':    '50'},
+                    100: {'label':   '100'},
+                    150: {'label':   '150'},
+                    200: {'label':   '200'},
+                    250: {'label':   '250'},
+                    300: {'label':   '300'},
+                    350: {'label':   '350'},
+                    400: {'label':   '400'},
+                    450: {'label':   '450'},
+                    500: {'label':   '500'},
+                },
+                value=250,
+            ),
+
+            dcc.Graph(
+                id='julia-graph',
+                figure=julia_fig
+                    ),
+
+            # html.Div([
+            #     dcc.Markdown(d("""
+            #         **Zoom and Relayout Data**
+            #
+            #         Click and drag on the graph to zoom or click on the zoom
+            #         buttons in the graph's menu bar.
+            #         Clicking on legend items will also fire
+            #         this event.
+            #     """)),
+            #     html.Pre(id='relayout-data', style=styles['pre']),
+            # ], className='three columns')
+            #
+            #     ])
+        ])
     ])
-])
+
+
+app.layout = serve_layout
 
 
 @app.callback(
     # Output('relayout-data', 'children'),
-    Output('graph', 'figure'),
+    [Output('render-job', 'data'),
+     Output('view', 'data')],
     [Input('iterations', 'value'),
-     Input('graph', 'relayoutData')])
-def display_selected_data(iterations, relayoutData):
-    xmin = relayoutData['xaxis.range[0]']
-    xmax = relayoutData['xaxis.range[1]']
-    ymin = relayoutData['yaxis.range[0]']
-    ymax = relayoutData['yaxis.range[1]']
+     Input('graph', 'relayoutData')],
+    [State('view', 'data'),
+     State('session', 'data')])
+def display_selected_data(iterations, relayoutData, view, session):
+    new_view = view_from_relayout(relayoutData, view)
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if triggered == ['graph.relayoutData'] and new_view == view:
+        raise PreventUpdate
 
-    x, y, z = mandelbrot_set(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, maxiter=iterations)
-    trace = go.Heatmap(x=x,
-                       y=y,
-                       z=z.T)
+    xmin, xmax, ymin, ymax = new_view
+    job = render_service.submit(session, (xmin, xmax, ymin, ymax, iterations))
 
-    data = [trace]
+    return job, new_view
 
-    layout = go.Layout(
-        title='Mandelbrot Plot',
-        width=1250,
-        height=1250,
-        xaxis = dict(
-        ),
-        yaxis = dict(
-          scaleanchor = "x",
-        ),
-    )
 
-    fig = go.Figure(data=data, layout=layout)
+@app.callback(
+    [Output('render-figure', 'data'),
+     Output('render-poll', 'disabled')],
+    [Input('render-poll', 'n_intervals'),
+     Input('render-job', 'data')],
+    [State('session', 'data'),
+     State('view', 'data')])
+def poll_render(n_intervals, job, session, view):
+    # A failed render stops the polling and is reported in place of the plot until the next zoom
+    try:
+        result = render_service.poll(session)
+    except Exception as error:
+        xmin, xmax, ymin, ymax = view or HOME_VIEW
+        return make_figure([xmin, xmax], [ymin, ymax], None, title='Render failed: %s' % error).to_dict(), True
+    if result is None:
+        if job is None:
+            raise PreventUpdate
+        return dash.no_update, False
+
+    figure, done = result
+    return figure, done
+
 
-    return fig
+# Rendered figures reach the graph through the browser, which adds the click grid
+app.clientside_callback(ADD_CLICK_GRID, Output('graph', 'figure'), [Input('render-figure', 'data')])
+
+
+@app.callback(
+    Output('julia-graph', 'figure'),
+    [Input('graph', 'clickData'),
+     Input('iterations', 'value')])
+def display_julia(clickData, iterations):
+    if not clickData:
+        raise PreventUpdate
+    point = clickData['points'][0]
+    c = complex(point['x'], point['y'])
+    x, y, z = julia_set(c, maxiter=iterations, width=JULIA_SIZE, height=JULIA_SIZE)
+    return make_figure(x, y, z, title='Julia Set for c = %.6g %+.6gi' % (c.real, c.imag), size=JULIA_SIZE)
 ################################################################################
 
 
@@ -0,0 +1,160 @@
+import math
+from decimal import Decimal, localcontext
+
+import numpy as np
+from numba import jit, prange
+
+from MandelBrotEngine import count_dtype, parallel_lock, RenderCancelled
+
+# Views whose pixel spacing relative to the magnitude of their coordinates drops below this are
+# rendered by perturbation, plain float64 iteration turns blocky around here.
+DEEP_ZOOM_THRESHOLD = 1e-12
+
+# Extra decimal digits carried by the reference orbit beyond what the pixel spacing needs
+EXTRA_DIGITS = 12
+
+# Series approximation stops skipping iterations once the cubic term is no longer this small
+# relative to the linear one at the corners of the view.
+SERIES_TOLERANCE = 1e-9
+
+# Pauldelbrot's criterion, only used when rebasing is off: a pixel whose orbit gets this close to
+# zero relative to the reference is flagged as glitched and recomputed with a new reference.
+GLITCH_TOLERANCE = 1e-3
+MAX_REFERENCES = 8
+
+# Rows iterated between two checks of the is_cancelled hook
+CANCEL_ROWS = 64
+
+#######################################################################################################################
+
+
+def needs_deep_zoom(xmin, xmax, ymin, ymax, width=1500, height=1500):
+    spacing = min(abs(float(xmax) - float(xmin)) / max(width - 1, 1), abs(float(ymax) - float(ymin)) / max(height - 1, 1))
+    scale = max(abs(float(xmin)), abs(float(xmax)), abs(float(ymin)), abs(float(ymax)), 1e-300)
+    return spacing < DEEP_ZOOM_THRESHOLD * scale
+
+
+def orbit_digits(spacing):
+    return max(20, int(math.ceil(-math.log10(spacing))) + EXTRA_DIGITS)
+
+
+def reference_orbit(center_re, center_im, maxiter, digits):
+    # Orbit Z_0 = 0, Z_k+1 = Z_k^2 + C of the reference point C in arbitrary precision, rounded to
+    # complex128. It stops at the last point before escaping, but always contains Z_1 = C.
+    with localcontext() as ctx:
+        ctx.prec = digits
+        cx, cy = Decimal(center_re), Decimal(center_im)
+        x, y = Decimal(0), Decimal(0)
+        orbit = [0j]
+        for k in range(maxiter):
+            x, y = x*x - y*y + cx, 2*x*y + cy
+            if k > 0 and x*x + y*y > 4:
+                break
+            orbit.append(complex(float(x), float(y)))
+    return np.array(orbit, dtype=np.complex128)
+
+
+def series_coefficients(orbit, radius):
+    # Coefficients of dz_n ~ A dc + B dc^2 + C dc^3 at the last iteration n where the cubic term is
+    # still negligible for |dc| <= radius and no pixel within radius can have escaped yet, the orbit
+    # being bounded by |Z_n| + |A| radius + |B| radius^2 + |C| radius^3 < 2. Returns n = 0 when
+    # nothing can be skipped.
+    a, b, c = 0j, 0j, 0j
+    skip, coefficients = 0, (0j, 0j, 0j)
+    for n in range(orbit.shape[0] - 2):
+        z2 = 2 * orbit[n]
+        a, b, c = z2*a + 1, z2*b + a*a, z2*c + 2*a*b
+        if not (np.isfinite(a) and np.isfinite(b) and np.isfinite(c)):
+            break
+        if abs(c) * radius**3 > SERIES_TOLERANCE * abs(a) * radius:
+            break
+        if abs(orbit[n + 1]) + abs(a)*radius + abs(b)*radius**2 + abs(c)*radius**3 >= 2:
+            break
+        skip, coefficients = n + 1, (a, b, c)
+    return skip, coefficients
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _perturbation_kernel(orbit, dx, dy, maxiter, skip, a, b, c, rebase, todo, n3, glitched):
+    # Iterates w_k = Z_ref + dz_k for every pixel marked in todo. Counts follow mandelbrot(), whose
+    # z_n is w_n+1 of the orbit started at zero.
+    last = orbit.shape[0] - 1
+    for i in prange(dx.shape[0]):
+        for j in range(dy.shape[0]):
+            if not todo[i, j]:
+                continue
+            dc = dx[i] + 1j*dy[j]
+            dz = a*dc + b*dc*dc + c*dc*dc*dc
+            ref = skip
+            k = skip
+            n3[i, j] = 0
+            glitched[i, j] = False
+            while k < maxiter:
+                dz = 2*orbit[ref]*dz + dz*dz + dc
+                ref += 1
+                k += 1
+                w = orbit[ref] + dz
+                w2 = w.real*w.real + w.imag*w.imag
+                if w2 > 4.0:
+                    n3[i, j] = k - 1
+                    break
+                z2 = orbit[ref].real*orbit[ref].real + orbit[ref].imag*orbit[ref].imag
+                if rebase:
+                    # Zhuoran's rebasing: restart from the beginning of the reference whenever the
+                    # pixel orbit gets closer to zero than its delta, or the reference runs out
+                    if w2 < dz.real*dz.real + dz.imag*dz.imag or ref == last:
+                        dz = w
+                        ref = 0
+                elif w2 < GLITCH_TOLERANCE*GLITCH_TOLERANCE*z2 or ref == last:
+                    glitched[i, j] = True
+                    break
+
+#######################################################################################################################
+
+
+def deep_mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500, series=True, rebase=True,
+                        is_cancelled=None):
+    # Bounds may be floats, strings or Decimals. Pixels are iterated as float64 offsets from a
+    # reference orbit through the center of the view computed in arbitrary precision.
+    with localcontext() as ctx:
+        ctx.prec = 100
+        xmin, xmax, ymin, ymax = Decimal(xmin), Decimal(xmax), Decimal(ymin), Decimal(ymax)
+        center_re, center_im = (xmin + xmax) / 2, (ymin + ymax) / 2
+        half_width, half_height = float((xmax - xmin) / 2), float((ymax - ymin) / 2)
+
+    dx = np.linspace(-half_width, half_width, width)
+    dy = np.linspace(-half_height, half_height, height)
+    spacing = min(2 * half_width / max(width - 1, 1), 2 * half_height / max(height - 1, 1))
+    digits = orbit_digits(spacing)
+
+    n3 = np.zeros((width, height), dtype=count_dtype(maxiter))
+    glitched = np.zeros((width, height), dtype=np.bool_)
+    todo = np.ones((width, height), dtype=np.bool_)
+    ref_dx, ref_dy = 0.0, 0.0
+    for _ in range(MAX_REFERENCES):
+        with localcontext() as ctx:
+            ctx.prec = digits
+            orbit = reference_orbit(center_re + Decimal(ref_dx), center_im + Decimal(ref_dy), maxiter, digits)
+        skip, (a, b, c) = 0, (0j, 0j, 0j)
+        if series:
+            radius = math.hypot(abs(ref_dx) + half_width, abs(ref_dy) + half_height)
+            skip, (a, b, c) = series_coefficients(orbit, radius)
+        rows = width if is_cancelled is None else CANCEL_ROWS
+        for start in range(0, width, rows):
+            if is_cancelled is not None and is_cancelled():
+                raise RenderCancelled()
+            stop = min(start + rows, width)
+            with parallel_lock:
+                _perturbation_kernel(orbit, dx[start:stop] - ref_dx, dy - ref_dy, maxiter, skip, a, b, c, rebase,
+                                     todo[start:stop], n3[start:stop], glitched[start:stop])
+        if not glitched.any():
+            break
+        # New reference at the glitched pixel nearest to the center, only glitched pixels are redone
+        todo = glitched.copy()
+        candidates = np.argwhere(glitched)
+        i, j = candidates[np.argmin(np.abs(dx[candidates[:, 0]]) + np.abs(dy[candidates[:, 1]]))]
+        ref_dx, ref_dy = dx[i], dy[j]
+
+    r1 = np.linspace(float(xmin), float(xmax), width)
+    r2 = np.linspace(float(ymin), float(ymax), height)
+    return r1, r2, n3
@@ -0,0 +1,744 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import numba
+from numba import jit, prange
+
+# Every kernel is compiled with cache=True: numba keeps the machine code in __pycache__ and later
+# processes load it instead of compiling again.
+
+# Backend used by mandelbrot_set: 'numba' (parallel prange), 'thread' (pool of nogil row bands)
+# or 'process' (pool of worker processes). Both can be overridden per call.
+BACKEND = os.environ.get('MANDELBROT_BACKEND', 'numba')
+WORKERS = int(os.environ.get('MANDELBROT_WORKERS', os.cpu_count() or 1))
+
+# Rows handed to a pool worker at a time. Small bands keep the cores balanced since rows through
+# the interior of the set cost maxiter per pixel while rows outside escape almost immediately.
+ROWS_PER_TASK = 16
+
+# Use mandelbrot_interior (cardioid/bulb test and periodicity checking) instead of mandelbrot.
+# Both give the same counts, interior pixels just stop long before maxiter.
+INTERIOR_CHECKS = True
+
+# Arithmetic of the numba brute force and progressive paths: 'complex' runs mandelbrot on
+# complex128, 'float32' and 'float64' run the vectorized escape-time kernel on separate real and
+# imaginary arrays, 'auto' picks float32 while the pixel spacing is at least FLOAT32_HEADROOM
+# float32 ulps of the view coordinates and float64 below that. float64 gives the counts of
+# 'complex'. float32 orbits drift from them near the boundary at any zoom, so 'auto' changes a
+# fraction of a percent of the pixels there and is only meant for previews and thumbnails.
+PRECISION = 'float64'
+FLOAT32_HEADROOM = 2**12
+
+# Pixels iterated in lockstep by the float32/float64 kernels
+LANES = 16
+
+# Default mandelbrot_set method: 'brute' evaluates every pixel, 'subdivide' uses Mariani-Silver
+# rectangle subdivision and only evaluates rectangle borders where they are not uniform.
+METHOD = 'brute'
+
+# Rectangles narrower than this (in pixels) are evaluated pixel by pixel instead of split again
+SUBDIVIDE_MIN_SIZE = 6
+
+# Two orbit points closer than this on both axes are treated as the same point of a cycle, float32
+# orbits settle only to within a few of its ulps
+PERIOD_TOLERANCE = 1e-13
+FLOAT32_PERIOD_TOLERANCE = 1e-6
+
+# Rows computed between two checks of the is_cancelled hook of mandelbrot_set
+CANCEL_ROWS = 64
+
+# Sample strides of the progressive passes, each one dividing the previous. The first pass computes
+# one sample in PREVIEW_STRIDES[0]**2, later passes only the samples the earlier ones did not cover.
+PREVIEW_STRIDES = (8, 4, 2, 1)
+
+# Samples of a new view closer than this fraction of a pixel to a sample of the previous frame are
+# copied from it by ReprojectedView
+REPROJECT_TOLERANCE = 1e-3
+
+# Half width of the default square of julia_set and julia_sets. Every filled Julia set of a c in
+# the Mandelbrot set lies within |z| <= 2, the interesting ones well inside this.
+JULIA_EXTENT = 1.6
+
+# Images of a julia_sets batch computed between two checks of its is_cancelled hook
+JULIA_CANCEL_IMAGES = 16
+
+_NOT_DONE = -2
+_pools = {}
+
+# Held around every launch of a parallel=True kernel. numba's workqueue threading layer, its
+# fallback where neither TBB nor OpenMP is installed, aborts the process when two Python threads
+# run parallel kernels at once, as the render service threads and the Dash server threads would.
+# Every launch already uses all the cores, so serializing them costs no throughput. Long renders
+# launch their kernels in groups of rows and release the lock in between.
+parallel_lock = threading.Lock()
+
+
+class RenderCancelled(Exception):
+    pass
+
+#######################################################################################################################
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def mandelbrot(c, maxiter, threshold=2):
+    z = c
+    for n in range(maxiter):
+        if abs(z) > threshold:
+            return n
+        z = z * z + c
+    return 0
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def julia(z, c, maxiter, threshold=2):
+    # Escape iteration of z under z -> z*z + c, counted like mandelbrot, which is julia(c, c)
+    for n in range(maxiter):
+        if abs(z) > threshold:
+            return n
+        z = z * z + c
+    return 0
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _orbit_code(z, c, maxiter, threshold=2):
+    # Escape iteration of z under z -> z*z + c, -1 if the orbit is proven periodic, maxiter if it
+    # neither escaped nor was found to be periodic within maxiter iterations.
+    #
+    # Brent's cycle detection: compare against a saved orbit point that is replaced each time the
+    # number of steps since the last save reaches a doubling limit. Landing on it again means the
+    # orbit is periodic and never escapes.
+    saved = z
+    steps = 0
+    limit = 2
+    for n in range(maxiter):
+        if abs(z) > threshold:
+            return n
+        z = z * z + c
+        if abs(z.real - saved.real) < PERIOD_TOLERANCE and abs(z.imag - saved.imag) < PERIOD_TOLERANCE:
+            return -1
+        steps += 1
+        if steps == limit:
+            saved = z
+            steps = 0
+            limit *= 2
+    return maxiter
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _escape_code(c, maxiter, threshold=2):
+    # Escape iteration of c, -1 if c is proven to be inside the set, maxiter if the orbit neither
+    # escaped nor was found to be periodic within maxiter iterations.
+    x, y = c.real, c.imag
+
+    # Main cardioid and period-2 bulb never escape
+    q = (x - 0.25)**2 + y*y
+    if q * (q + (x - 0.25)) <= 0.25 * y*y:
+        return -1
+    if (x + 1.0)**2 + y*y <= 0.0625:
+        return -1
+
+    return _orbit_code(c, c, maxiter, threshold)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def mandelbrot_interior(c, maxiter, threshold=2):
+    n = _escape_code(c, maxiter, threshold)
+    if n < 0 or n == maxiter:
+        return 0
+    return n
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _mandelbrot_rows(r1, r2, maxiter, n3, start, stop, interior_checks):
+    for i in range(start, stop):
+        for j in range(r2.shape[0]):
+            if interior_checks:
+                n3[i, j] = mandelbrot_interior(r1[i] + 1j*r2[j], maxiter)
+            else:
+                n3[i, j] = mandelbrot(r1[i] + 1j*r2[j], maxiter)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _mandelbrot_prange(r1, r2, maxiter, n3, interior_checks):
+    for i in prange(r1.shape[0]):
+        for j in range(r2.shape[0]):
+            if interior_checks:
+                n3[i, j] = mandelbrot_interior(r1[i] + 1j*r2[j], maxiter)
+            else:
+                n3[i, j] = mandelbrot(r1[i] + 1j*r2[j], maxiter)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def julia_interior(z, c, maxiter, threshold=2):
+    n = _orbit_code(z, c, maxiter, threshold)
+    if n < 0 or n == maxiter:
+        return 0
+    return n
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _julia_batch(r1, r2, cs, maxiter, n3s, interior_checks):
+    # One parallel loop over the rows of every image, so that small images still keep all
+    # threads busy and the thread pool is entered once for the whole batch
+    width = r1.shape[0]
+    for task in prange(cs.shape[0] * width):
+        k, i = task // width, task % width
+        for j in range(r2.shape[0]):
+            if interior_checks:
+                n3s[k, i, j] = julia_interior(r1[i] + 1j*r2[j], cs[k], maxiter)
+            else:
+                n3s[k, i, j] = julia(r1[i] + 1j*r2[j], cs[k], maxiter)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _mandelbrot_resume(r1, r2, z, counts, escaped, reached, maxiter, threshold=2):
+    # Continues the orbits of the pixels that have not escaped from iteration reached[i] of their
+    # row up to maxiter
+    for i in prange(r1.shape[0]):
+        for j in range(r2.shape[0]):
+            if escaped[i, j]:
+                continue
+            c = r1[i] + 1j*r2[j]
+            zz = z[i, j]
+            for n in range(reached[i], maxiter):
+                if abs(zz) > threshold:
+                    escaped[i, j] = True
+                    counts[i, j] = n
+                    break
+                zz = zz * zz + c
+            z[i, j] = zz
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _subdivide_pixel(r1, r2, i, j, maxiter, codes):
+    if codes[i, j] == _NOT_DONE:
+        codes[i, j] = _escape_code(r1[i] + 1j*r2[j], maxiter)
+    return codes[i, j]
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _subdivide_block(r1, r2, maxiter, codes, i0, i1, j0, j1):
+    # Mariani-Silver on the inclusive pixel rectangle [i0, i1] x [j0, j1]. A rectangle whose border
+    # has a single escape code is filled with it, otherwise it is split in four along shared edges.
+    # Borders of orbits that merely ran out of iterations are never used for filling, they may
+    # enclose exterior points of lower count.
+    stack = [(i0, i1, j0, j1)]
+    while len(stack) > 0:
+        a, b, c, d = stack.pop()
+        value = _subdivide_pixel(r1, r2, a, c, maxiter, codes)
+        uniform = value != maxiter
+        for i in range(a, b + 1):
+            if _subdivide_pixel(r1, r2, i, c, maxiter, codes) != value:
+                uniform = False
+            if _subdivide_pixel(r1, r2, i, d, maxiter, codes) != value:
+                uniform = False
+        for j in range(c, d + 1):
+            if _subdivide_pixel(r1, r2, a, j, maxiter, codes) != value:
+                uniform = False
+            if _subdivide_pixel(r1, r2, b, j, maxiter, codes) != value:
+                uniform = False
+
+        if uniform:
+            for i in range(a + 1, b):
+                for j in range(c + 1, d):
+                    codes[i, j] = value
+        elif b - a < SUBDIVIDE_MIN_SIZE or d - c < SUBDIVIDE_MIN_SIZE:
+            for i in range(a + 1, b):
+                for j in range(c + 1, d):
+                    _subdivide_pixel(r1, r2, i, j, maxiter, codes)
+        else:
+            mi = (a + b) // 2
+            mj = (c + d) // 2
+            stack.append((a, mi, c, mj))
+            stack.append((mi, b, c, mj))
+            stack.append((a, mi, mj, d))
+            stack.append((mi, b, mj, d))
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _mandelbrot_subdivide(r1, r2, maxiter, n3, starts):
+    # Each block of rows is subdivided independently, blocks do not share any pixels
+    codes = np.full(n3.shape, _NOT_DONE, dtype=np.int64)
+    for k in prange(starts.shape[0] - 1):
+        _subdivide_block(r1, r2, maxiter, codes, starts[k], starts[k + 1] - 1, 0, r2.shape[0] - 1)
+    for i in prange(n3.shape[0]):
+        for j in range(n3.shape[1]):
+            n = codes[i, j]
+            n3[i, j] = 0 if n < 0 or n == maxiter else n
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _mandelbrot_stride(r1, r2, maxiter, n3, stride, coarser, interior_checks):
+    # Samples every stride-th pixel on both axes, skipping those on the lattice of the coarser pass
+    for a in prange((r1.shape[0] + stride - 1) // stride):
+        i = a * stride
+        for j in range(0, r2.shape[0], stride):
+            if coarser > 0 and i % coarser == 0 and j % coarser == 0:
+                continue
+            if interior_checks:
+                n3[i, j] = mandelbrot_interior(r1[i] + 1j*r2[j], maxiter)
+            else:
+                n3[i, j] = mandelbrot(r1[i] + 1j*r2[j], maxiter)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _mandelbrot_masked(r1, r2, maxiter, n3, need, interior_checks):
+    for i in prange(r1.shape[0]):
+        for j in range(r2.shape[0]):
+            if not need[i, j]:
+                continue
+            if interior_checks:
+                n3[i, j] = mandelbrot_interior(r1[i] + 1j*r2[j], maxiter)
+            else:
+                n3[i, j] = mandelbrot(r1[i] + 1j*r2[j], maxiter)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _escape_time_row(x0, ys, columns, c_re, c_im, mandelbrot, maxiter, threshold2, tolerance, out, interior_checks):
+    # Escape time of the samples x0 + i*ys[columns] of a row into out[columns], all arithmetic in
+    # the dtype of ys. The samples are iterated in chunks of LANES pixels that run in lockstep
+    # without branches so that they compile to SIMD instructions, float32 fitting twice as many
+    # lanes. A pixel is alive until its first failed check and its count is the number of checks it
+    # passed, as in mandelbrot and julia. With mandelbrot set every sample is its own c, otherwise
+    # c = c_re + i*c_im for all of them.
+    height = columns.shape[0]
+    zr = np.empty(LANES, dtype=ys.dtype)
+    zi = np.empty(LANES, dtype=ys.dtype)
+    saved_r = np.empty(LANES, dtype=ys.dtype)
+    saved_i = np.empty(LANES, dtype=ys.dtype)
+    add_i = np.empty(LANES, dtype=ys.dtype)
+    count = np.empty(LANES, dtype=np.int32)
+    alive = np.empty(LANES, dtype=np.int32)
+    add_r = x0 if mandelbrot else c_re
+    for start in range(0, height, LANES):
+        lanes = min(LANES, height - start)
+        for k in range(LANES):
+            y = ys[columns[start + k]] if k < lanes else ys[columns[start]]
+            add_i[k] = y if mandelbrot else c_im
+            zr[k] = x0
+            zi[k] = y
+            saved_r[k] = x0
+            saved_i[k] = y
+            count[k] = 0
+            alive[k] = k < lanes
+            if mandelbrot and interior_checks:
+                # Main cardioid and period-2 bulb, these lanes start dead with count maxiter
+                x, yy = np.float64(x0), np.float64(y)
+                q = (x - 0.25)**2 + yy*yy
+                if q * (q + (x - 0.25)) <= 0.25 * yy*yy or (x + 1.0)**2 + yy*yy <= 0.0625:
+                    alive[k] = 0
+                    count[k] = maxiter
+
+        # Brent's cycle detection as in _orbit_code, saving the orbit points of all lanes at the
+        # same iterations. A lane found periodic dies with count maxiter.
+        n = 0
+        limit = 2
+        while n < maxiter:
+            stop = min(n + 8, maxiter)
+            for _ in range(n, stop):
+                for k in range(LANES):
+                    r2 = zr[k]*zr[k]
+                    i2 = zi[k]*zi[k]
+                    a = alive[k] & (r2 + i2 <= threshold2)
+                    count[k] += a
+                    zi[k] = (zr[k] + zr[k])*zi[k] + add_i[k]
+                    zr[k] = r2 - i2 + add_r
+                    p = (a & interior_checks & (abs(zr[k] - saved_r[k]) < tolerance)
+                         & (abs(zi[k] - saved_i[k]) < tolerance))
+                    count[k] += p * maxiter
+                    alive[k] = a & (1 - p)
+            n = stop
+            if interior_checks and n >= limit:
+                saved_r[:] = zr
+                saved_i[:] = zi
+                limit *= 2
+            if alive.sum() == 0:
+                break
+
+        for k in range(lanes):
+            out[columns[start + k]] = 0 if alive[k] or count[k] >= maxiter else count[k]
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _escape_time_split(cr, ci, maxiter, threshold2, tolerance, n3, interior_checks):
+    # Mandelbrot counts on separate real and imaginary arrays of either float dtype
+    zero = ci.dtype.type(0)
+    columns = np.arange(ci.shape[0])
+    for i in prange(cr.shape[0]):
+        _escape_time_row(cr[i], ci, columns, zero, zero, True, maxiter, threshold2, tolerance, n3[i], interior_checks)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _escape_time_stride(cr, ci, maxiter, threshold2, tolerance, n3, stride, coarser, interior_checks):
+    # _mandelbrot_stride on separate real and imaginary arrays
+    zero = ci.dtype.type(0)
+    columns = np.arange(0, ci.shape[0], stride)
+    # Columns of the rows on the coarser lattice that it did not cover
+    finer = columns[columns % max(coarser, 1) != 0]
+    for a in prange((cr.shape[0] + stride - 1) // stride):
+        i = a * stride
+        row = finer if coarser > 0 and i % coarser == 0 else columns
+        _escape_time_row(cr[i], ci, row, zero, zero, True, maxiter, threshold2, tolerance, n3[i], interior_checks)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _escape_time_masked(cr, ci, maxiter, threshold2, tolerance, n3, need, interior_checks):
+    # _mandelbrot_masked on separate real and imaginary arrays
+    zero = ci.dtype.type(0)
+    for i in prange(cr.shape[0]):
+        _escape_time_row(cr[i], ci, np.flatnonzero(need[i]), zero, zero, True, maxiter, threshold2, tolerance, n3[i],
+                         interior_checks)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _julia_split(cr, ci, cs_re, cs_im, maxiter, threshold2, tolerance, n3s, interior_checks):
+    # Julia counts of every c in cs_re + i*cs_im, one parallel loop over the rows of all images
+    width = cr.shape[0]
+    columns = np.arange(ci.shape[0])
+    for task in prange(cs_re.shape[0] * width):
+        k, i = task // width, task % width
+        _escape_time_row(cr[i], ci, columns, cs_re[k], cs_im[k], False, maxiter, threshold2, tolerance, n3s[k, i],
+                         interior_checks)
+
+
+def _mandelbrot_band(r1, r2, maxiter, interior_checks):
+    # Entry point for the process backend, the result is pickled back to the parent
+    n3 = np.empty((r1.shape[0], r2.shape[0]), dtype=count_dtype(maxiter))
+    _mandelbrot_rows(r1, r2, maxiter, n3, 0, r1.shape[0], interior_checks)
+    return n3
+
+
+def choose_precision(xmin, xmax, ymin, ymax, width, height):
+    # Cheapest dtype whose resolution is still far below the pixel spacing of the view
+    spacing = min(abs(xmax - xmin) / max(width - 1, 1), abs(ymax - ymin) / max(height - 1, 1))
+    scale = max(abs(xmin), abs(xmax), abs(ymin), abs(ymax), 1.0)
+    if spacing >= FLOAT32_HEADROOM * np.finfo(np.float32).eps * scale:
+        return 'float32'
+    return 'float64'
+
+
+def resolve_precision(precision, xmin, xmax, ymin, ymax, width, height):
+    # Precision a render of the view runs with, PRECISION for None and choose_precision for 'auto'
+    precision = PRECISION if precision is None else precision
+    if precision == 'auto':
+        return choose_precision(xmin, xmax, ymin, ymax, width, height)
+    if precision not in ('complex', 'float32', 'float64'):
+        raise ValueError("Unknown precision %r, expected 'auto', 'complex', 'float32' or 'float64'" % precision)
+    return precision
+
+
+def _split_arguments(precision):
+    # Sample dtype, squared escape radius and period tolerance of the float32/float64 kernels. The
+    # abs(z) > 2 of mandelbrot only holds once |z| rounds above 2, past 2 plus half an ulp, whose
+    # square lies just above the float after 4. |z|**2 is compared against that float rather than
+    # 4, so orbits through points like 1.2 + 1.6i, where |z|**2 rounds to it, escape at the same
+    # iteration as in mandelbrot.
+    dtype = np.dtype(precision).type
+    tolerance = PERIOD_TOLERANCE if precision == 'float64' else FLOAT32_PERIOD_TOLERANCE
+    return dtype, np.nextafter(dtype(4), dtype(5)), dtype(tolerance)
+
+
+def count_dtype(maxiter):
+    # Smallest unsigned integer type holding every count below maxiter
+    if maxiter <= 2**8:
+        return np.uint8
+    if maxiter <= 2**16:
+        return np.uint16
+    return np.uint32
+
+
+def _get_pool(backend, workers):
+    key = (backend, workers)
+    if key not in _pools:
+        if backend == 'thread':
+            _pools[key] = ThreadPoolExecutor(max_workers=workers)
+        else:
+            _pools[key] = ProcessPoolExecutor(max_workers=workers)
+    return _pools[key]
+
+
+def _bands(width, rows):
+    return [(start, min(start + rows, width)) for start in range(0, width, rows)]
+
+
+def _check_cancelled(is_cancelled):
+    if is_cancelled is not None and is_cancelled():
+        raise RenderCancelled()
+
+
+def _wait(futures, is_cancelled):
+    for future in futures:
+        if is_cancelled is not None and is_cancelled():
+            for pending in futures:
+                pending.cancel()
+            raise RenderCancelled()
+        future.result()
+
+#######################################################################################################################
+
+
+def mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500, backend=None, workers=None,
+                   interior_checks=None, method=None, precision=None, is_cancelled=None):
+    backend = BACKEND if backend is None else backend
+    workers = WORKERS if workers is None else workers
+    interior_checks = INTERIOR_CHECKS if interior_checks is None else interior_checks
+    method = METHOD if method is None else method
+    precision = resolve_precision(precision, xmin, xmax, ymin, ymax, width, height)
+
+    r1 = np.linspace(xmin, xmax, width)
+    r2 = np.linspace(ymin, ymax, height)
+    n3 = np.empty((width, height), dtype=count_dtype(maxiter))
+
+    # With a cancellation hook the numba kernels run on groups of rows and is_cancelled() is polled
+    # in between, raising RenderCancelled once it returns True.
+    groups = [(0, width)] if is_cancelled is None else _bands(width, CANCEL_ROWS)
+
+    if method == 'subdivide':
+        # Subdivision always runs on the numba thread pool, split into a few row blocks per worker.
+        # It relies on the interior proofs of _escape_code, so interior_checks does not apply.
+        numba.set_num_threads(max(1, min(workers, numba.config.NUMBA_NUM_THREADS)))
+        for start, stop in groups:
+            _check_cancelled(is_cancelled)
+            blocks = max(1, min(4 * workers, (stop - start) // (2 * SUBDIVIDE_MIN_SIZE)))
+            starts = np.linspace(0, stop - start, blocks + 1).astype(np.int64)
+            with parallel_lock:
+                _mandelbrot_subdivide(r1[start:stop], r2, maxiter, n3[start:stop], starts)
+    elif method != 'brute':
+        raise ValueError("Unknown method %r, expected 'brute' or 'subdivide'" % method)
+    elif backend == 'numba' and precision != 'complex':
+        dtype, threshold2, tolerance = _split_arguments(precision)
+        cr, ci = r1.astype(dtype), r2.astype(dtype)
+        numba.set_num_threads(max(1, min(workers, numba.config.NUMBA_NUM_THREADS)))
+        for start, stop in groups:
+            _check_cancelled(is_cancelled)
+            with parallel_lock:
+                _escape_time_split(cr[start:stop], ci, maxiter, threshold2, tolerance, n3[start:stop], interior_checks)
+    elif backend == 'numba':
+        numba.set_num_threads(max(1, min(workers, numba.config.NUMBA_NUM_THREADS)))
+        for start, stop in groups:
+            _check_cancelled(is_cancelled)
+            with parallel_lock:
+                _mandelbrot_prange(r1[start:stop], r2, maxiter, n3[start:stop], interior_checks)
+    elif backend == 'thread':
+        pool = _get_pool(backend, workers)
+        _wait([pool.submit(_mandelbrot_rows, r1, r2, maxiter, n3, start, stop, interior_checks)
+               for start, stop in _bands(width, ROWS_PER_TASK)], is_cancelled)
+    elif backend == 'process':
+        pool = _get_pool(backend, workers)
+        bands = _bands(width, ROWS_PER_TASK)
+        futures = [pool.submit(_mandelbrot_band, r1[start:stop], r2, maxiter, interior_checks) for start, stop in bands]
+        _wait(futures, is_cancelled)
+        for (start, stop), future in zip(bands, futures):
+            n3[start:stop] = future.result()
+    else:
+        raise ValueError("Unknown backend %r, expected 'numba', 'thread' or 'process'" % backend)
+
+    return r1, r2, n3
+
+
+def mandelbrot_pass(r1, r2, maxiter, n3, stride, coarser=0, interior_checks=None, is_cancelled=None, precision=None):
+    # One progressive pass over n3 in place, see PREVIEW_STRIDES. The precision is resolved for the
+    # whole of r1 x r2 as in mandelbrot_set, so the passes together give its counts.
+    interior_checks = INTERIOR_CHECKS if interior_checks is None else interior_checks
+    width = r1.shape[0]
+    precision = resolve_precision(precision, r1[0], r1[-1], r2[0], r2[-1], width, r2.shape[0])
+    if precision != 'complex':
+        dtype, threshold2, tolerance = _split_arguments(precision)
+        cr, ci = r1.astype(dtype), r2.astype(dtype)
+    rows = width if is_cancelled is None else CANCEL_ROWS * stride
+    for start in range(0, width, rows):
+        _check_cancelled(is_cancelled)
+        stop = min(start + rows, width)
+        with parallel_lock:
+            if precision == 'complex':
+                _mandelbrot_stride(r1[start:stop], r2, maxiter, n3[start:stop], stride, coarser, interior_checks)
+            else:
+                _escape_time_stride(cr[start:stop], ci, maxiter, threshold2, tolerance, n3[start:stop], stride,
+                                    coarser, interior_checks)
+
+
+def preview(n3, stride):
+    # Every pixel takes the value of the sample at the corner of its stride x stride block
+    if stride == 1:
+        return n3
+    ix = np.arange(n3.shape[0]) // stride * stride
+    iy = np.arange(n3.shape[1]) // stride * stride
+    return n3[np.ix_(ix, iy)]
+
+
+def progressive_mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500, strides=None,
+                               interior_checks=None, is_cancelled=None, precision=None):
+    # Yields (r1, r2, n3) after every pass of strides, the last one being equal to mandelbrot_set.
+    # Each pixel is evaluated once over all passes.
+    strides = PREVIEW_STRIDES if strides is None else strides
+    precision = resolve_precision(precision, xmin, xmax, ymin, ymax, width, height)
+    r1 = np.linspace(xmin, xmax, width)
+    r2 = np.linspace(ymin, ymax, height)
+    n3 = np.empty((width, height), dtype=count_dtype(maxiter))
+    coarser = 0
+    for stride in strides:
+        mandelbrot_pass(r1, r2, maxiter, n3, stride, coarser, interior_checks, is_cancelled, precision)
+        coarser = stride
+        yield r1, r2, preview(n3, stride)
+
+
+def julia_set(c, xmin=-JULIA_EXTENT, xmax=JULIA_EXTENT, ymin=-JULIA_EXTENT, ymax=JULIA_EXTENT, maxiter=250, width=1500,
+              height=1500, workers=None, interior_checks=None, precision=None, is_cancelled=None):
+    # Filled Julia set of z -> z*z + c, counted like mandelbrot_set. Runs on the numba backend.
+    r1, r2, n3s = julia_sets([c], xmin, xmax, ymin, ymax, maxiter, width, height, workers, interior_checks, precision,
+                             is_cancelled)
+    return r1, r2, n3s[0]
+
+
+def julia_sets(cs, xmin=-JULIA_EXTENT, xmax=JULIA_EXTENT, ymin=-JULIA_EXTENT, ymax=JULIA_EXTENT, maxiter=250, width=150,
+               height=150, workers=None, interior_checks=None, precision=None, is_cancelled=None):
+    # Julia sets of every c in cs on the same sample grid, for thumbnails and parameter atlases.
+    # Returns (r1, r2, n3s) with n3s[k] the counts for cs[k], n3s shaped cs.shape + (width, height).
+    # All images go through one parallel loop over their rows, which keeps every thread busy even
+    # when the images are small.
+    workers = WORKERS if workers is None else workers
+    interior_checks = INTERIOR_CHECKS if interior_checks is None else interior_checks
+    precision = resolve_precision(precision, xmin, xmax, ymin, ymax, width, height)
+    cs = np.asarray(cs, dtype=np.complex128)
+    flat = cs.ravel()
+
+    r1 = np.linspace(xmin, xmax, width)
+    r2 = np.linspace(ymin, ymax, height)
+    n3s = np.empty((flat.size, width, height), dtype=count_dtype(maxiter))
+
+    # With a cancellation hook a single image runs in groups of rows and a batch in groups of
+    # images, polling is_cancelled() in between
+    if is_cancelled is None:
+        groups = [(0, flat.size, 0, width)]
+    elif flat.size == 1:
+        groups = [(0, 1, start, stop) for start, stop in _bands(width, CANCEL_ROWS)]
+    else:
+        groups = [(start, stop, 0, width) for start, stop in _bands(flat.size, JULIA_CANCEL_IMAGES)]
+
+    numba.set_num_threads(max(1, min(workers, numba.config.NUMBA_NUM_THREADS)))
+    for k0, k1, i0, i1 in groups:
+        _check_cancelled(is_cancelled)
+        with parallel_lock:
+            if precision == 'complex':
+                _julia_batch(r1[i0:i1], r2, flat[k0:k1], maxiter, n3s[k0:k1, i0:i1], interior_checks)
+            else:
+                dtype, threshold2, tolerance = _split_arguments(precision)
+                _julia_split(r1[i0:i1].astype(dtype), r2.astype(dtype), flat.real[k0:k1].astype(dtype),
+                             flat.imag[k0:k1].astype(dtype), maxiter, threshold2, tolerance, n3s[k0:k1, i0:i1],
+                             interior_checks)
+    return r1, r2, n3s.reshape(cs.shape + (width, height))
+
+
+class ResumableView(object):
+    # Keeps the escape state (current z, escape iteration, escaped flag) of every pixel of the last
+    # viewport so that raising maxiter only continues the pixels still iterating and lowering it is
+    # answered from the stored counts. Output matches mandelbrot_set for the same arguments. Rows
+    # are iterated in groups when a cancellation hook is given, every row keeping the iteration it
+    # has reached, so that a cancelled render leaves a state the next one continues from.
+
+    def __init__(self, width=1500, height=1500):
+        self.width = width
+        self.height = height
+        self.bounds = None
+        self._lock = threading.Lock()
+
+    def _reset(self, bounds):
+        xmin, xmax, ymin, ymax = bounds
+        self.bounds = bounds
+        self.reached = np.zeros(self.width, dtype=np.int64)
+        self.r1 = np.linspace(xmin, xmax, self.width)
+        self.r2 = np.linspace(ymin, ymax, self.height)
+        self.z = self.r1[:, np.newaxis] + 1j*self.r2[np.newaxis, :]
+        self.counts = np.zeros((self.width, self.height), dtype=np.int32)
+        self.escaped = np.zeros((self.width, self.height), dtype=np.bool_)
+
+    def render(self, xmin, xmax, ymin, ymax, maxiter=250, is_cancelled=None):
+        with self._lock:
+            bounds = (xmin, xmax, ymin, ymax)
+            if bounds != self.bounds:
+                self._reset(bounds)
+            for start, stop in [(0, self.width)] if is_cancelled is None else _bands(self.width, CANCEL_ROWS):
+                _check_cancelled(is_cancelled)
+                if self.reached[start:stop].min() >= maxiter:
+                    continue
+                with parallel_lock:
+                    _mandelbrot_resume(self.r1[start:stop], self.r2, self.z[start:stop], self.counts[start:stop],
+                                       self.escaped[start:stop], self.reached[start:stop], maxiter)
+                np.maximum(self.reached[start:stop], maxiter, out=self.reached[start:stop])
+            n3 = np.where(self.escaped & (self.counts < maxiter), self.counts, 0).astype(count_dtype(maxiter))
+            return self.r1, self.r2, n3
+
+
+def _match_samples(old, new, tolerance):
+    # Index of the sample of old coinciding with every sample of new, -1 where there is none
+    spacing = (new[-1] - new[0]) / max(new.shape[0] - 1, 1)
+    k = np.clip(np.searchsorted(old, new), 1, old.shape[0] - 1)
+    nearest = np.where(np.abs(old[k - 1] - new) < np.abs(old[k] - new), k - 1, k)
+    return np.where(np.abs(old[nearest] - new) <= tolerance * spacing, nearest, -1)
+
+
+def _snap(lo, hi, old, count):
+    # Shifts [lo, hi] by less than half a pixel onto the sample lattice of old if both have the same
+    # spacing, so that a pan reuses whole columns of the previous frame
+    spacing = (hi - lo) / max(count - 1, 1)
+    old_spacing = (old[-1] - old[0]) / max(old.shape[0] - 1, 1)
+    if count < 2 or old.shape[0] < 2 or abs(spacing - old_spacing) > 1e-9 * abs(old_spacing):
+        return lo, hi
+    offset = (lo - old[0]) / old_spacing
+    shift = (round(offset) - offset) * old_spacing
+    return lo + shift, hi + shift
+
+
+class ReprojectedView(object):
+    # Keeps the last rendered frame with its exact sample coordinates. Samples of a new view that
+    # coincide with samples of the last frame are copied over, so a pan only computes the newly
+    # exposed strips. With snap, pans are aligned to the pixel lattice of the last frame.
+
+    def __init__(self, width=1500, height=1500, tolerance=None, snap=True):
+        self.width = width
+        self.height = height
+        self.tolerance = REPROJECT_TOLERANCE if tolerance is None else tolerance
+        self.snap = snap
+        self.frame = None
+        self.computed = 0
+        self._lock = threading.Lock()
+
+    def render(self, xmin, xmax, ymin, ymax, maxiter=250, interior_checks=None, is_cancelled=None, precision=None):
+        interior_checks = INTERIOR_CHECKS if interior_checks is None else interior_checks
+        with self._lock:
+            frame = self.frame if self.frame is not None and self.frame[3] == maxiter else None
+            if frame is not None and self.snap:
+                xmin, xmax = _snap(xmin, xmax, frame[0], self.width)
+                ymin, ymax = _snap(ymin, ymax, frame[1], self.height)
+
+            r1 = np.linspace(xmin, xmax, self.width)
+            r2 = np.linspace(ymin, ymax, self.height)
+            n3 = np.empty((self.width, self.height), dtype=count_dtype(maxiter))
+            need = np.ones((self.width, self.height), dtype=np.bool_)
+            if frame is not None:
+                old_r1, old_r2, old_n3, _ = frame
+                ix = _match_samples(old_r1, r1, self.tolerance)
+                iy = _match_samples(old_r2, r2, self.tolerance)
+                mx, my = ix >= 0, iy >= 0
+                n3[np.ix_(mx, my)] = old_n3[np.ix_(ix[mx], iy[my])]
+                need[np.ix_(mx, my)] = False
+
+            self.computed = int(need.sum())
+            precision = resolve_precision(precision, xmin, xmax, ymin, ymax, self.width, self.height)
+            if precision != 'complex':
+                dtype, threshold2, tolerance = _split_arguments(precision)
+                cr, ci = r1.astype(dtype), r2.astype(dtype)
+            for start, stop in [(0, self.width)] if is_cancelled is None else _bands(self.width, CANCEL_ROWS):
+                _check_cancelled(is_cancelled)
+                with parallel_lock:
+                    if precision == 'complex':
+                        _mandelbrot_masked(r1[start:stop], r2, maxiter, n3[start:stop], need[start:stop],
+                                           interior_checks)
+                    else:
+                        _escape_time_masked(cr[start:stop], ci, maxiter, threshold2, tolerance, n3[start:stop],
+                                            need[start:stop], interior_checks)
+
+            self.frame = (r1, r2, n3, maxiter)
+            return r1, r2, n3
@@ -0,0 +1,77 @@
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+# Viridis control points, interpolated into the 256 entry palette of the PNG
+VIRIDIS = [
+    (0.0, (68, 1, 84)),
+    (0.13, (71, 44, 122)),
+    (0.25, (59, 81, 139)),
+    (0.38, (44, 113, 142)),
+    (0.5, (33, 144, 141)),
+    (0.63, (39, 173, 129)),
+    (0.75, (92, 200, 99)),
+    (0.88, (170, 220, 50)),
+    (1.0, (253, 231, 37)),
+]
+
+PNG_COMPRESSION = 6
+
+
+def palette(colorscale=VIRIDIS, size=256):
+    stops = np.array([stop for stop, _ in colorscale])
+    colors = np.array([color for _, color in colorscale], dtype=np.float64)
+    t = np.linspace(0, 1, size)
+    return np.stack([np.interp(t, stops, colors[:, k]) for k in range(3)], axis=1).round().astype(np.uint8)
+
+
+def color_indices(n3):
+    # Scales counts onto the palette like Heatmap's automatic zmin/zmax and flips the (x, y) count
+    # array into image rows, top row first.
+    n3 = np.asarray(n3)
+    lo, hi = int(n3.min()), int(n3.max())
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    indices = ((n3.astype(np.float32) - lo) * scale).round().astype(np.uint8)
+    return np.ascontiguousarray(indices.T[::-1])
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(indices, colors):
+    # 8-bit palette PNG, one byte per pixel before compression
+    height, width = indices.shape
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = indices
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+        _png_chunk(b'PLTE', colors.tobytes()),
+        _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), PNG_COMPRESSION)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def png_data_uri(n3, colorscale=VIRIDIS):
+    png = encode_png(color_indices(n3), palette(colorscale))
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+
+def layout_image(x, y, n3, colorscale=VIRIDIS):
+    # Layout image covering the samples of x and y, each sample centered in its pixel
+    dx = (x[-1] - x[0]) / max(len(x) - 1, 1)
+    dy = (y[-1] - y[0]) / max(len(y) - 1, 1)
+    return dict(
+        source=png_data_uri(n3, colorscale),
+        xref='x',
+        yref='y',
+        x=x[0] - dx / 2,
+        y=y[-1] + dy / 2,
+        sizex=x[-1] - x[0] + dx,
+        sizey=y[-1] - y[0] + dy,
+        sizing='stretch',
+        layer='below',
+    )
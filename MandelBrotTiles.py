@@ -0,0 +1,314 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from MandelBrotEngine import mandelbrot_pass, count_dtype, resolve_precision, PREVIEW_STRIDES, RenderCancelled
+
+# Tiles are TILE_SIZE x TILE_SIZE samples. At zoom level L a tile covers BASE_SPAN / 2**L of the
+# complex plane on each side, tile (tx, ty) starting at (tx * span, ty * span), so the tiles of one
+# level form a fixed lattice and each tile splits into four tiles of the next level (a quadtree).
+TILE_SIZE = 128
+BASE_SPAN = 4.0
+
+
+class TileCache(object):
+    # Memory bounded LRU of computed tiles keyed by (level, tx, ty, maxiter, precision)
+
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            if key in self._tiles:
+                self.nbytes -= self._tiles.pop(key).nbytes
+            self._tiles[key] = tile
+            self.nbytes += tile.nbytes
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+
+
+default_cache = TileCache()
+
+
+# Directory of the on-disk tile store shared by every server process on the machine, an empty
+# MANDELBROT_TILE_STORE disables it. Bump STORE_VERSION when the counts of a tile change meaning.
+TILE_STORE_DIR = os.environ.get('MANDELBROT_TILE_STORE', os.path.join(tempfile.gettempdir(), 'mandelbrot-tiles'))
+TILE_STORE_BYTES = int(os.environ.get('MANDELBROT_TILE_STORE_BYTES', 4 * 2**30))
+STORE_VERSION = 2
+
+
+class TileStore(object):
+    # Persistent second level below TileCache: one .npy file per tile, named by a hash of everything
+    # the tile depends on, so that processes never need to agree on anything but the directory.
+    # Files are written to a temporary name and renamed into place, readers see whole tiles or none.
+    # Reading a tile touches its mtime and the least recently used files are deleted once the store
+    # grows past max_bytes.
+
+    def __init__(self, directory, max_bytes=TILE_STORE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._nbytes = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        name = hashlib.sha1(repr((STORE_VERSION, TILE_SIZE, BASE_SPAN) + tuple(key)).encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name + '.npy')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            tile = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted meanwhile or unreadable, the caller recomputes and overwrites it
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tile
+
+    def put(self, key, tile):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(tile))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        with self._lock:
+            if self._nbytes is not None:
+                self._nbytes += os.path.getsize(path)
+            if self._nbytes is None or self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _files(self, suffix='.npy'):
+        # Leaves the temporary files of writers in other processes alone unless asked for
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self):
+        # Other processes add files too, so the size is recounted from the directory before deleting.
+        # Evicts down to 90% of max_bytes so that the next few puts do not walk the directory again.
+        files = self._files()
+        nbytes = sum(size for _, size, _ in files)
+        if nbytes > self.max_bytes:
+            for _, size, path in sorted(files):
+                if nbytes <= 0.9 * self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                nbytes -= size
+        self._nbytes = nbytes
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._files(suffix=''):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._nbytes = 0
+
+
+default_store = TileStore(TILE_STORE_DIR) if TILE_STORE_DIR else None
+
+#######################################################################################################################
+
+
+def tile_level(spacing):
+    # Level whose sample spacing is nearest to the requested one on a log scale, within a factor of
+    # sqrt(2) of it, so that a view costs about as many samples as it has pixels
+    return max(0, int(round(math.log2(BASE_SPAN / (TILE_SIZE * spacing)))))
+
+
+def tile_bounds(level, tx, ty):
+    # Coordinates of the first and last samples of a tile, as xmin, xmax, ymin, ymax
+    span = BASE_SPAN / 2**level
+    last = (TILE_SIZE - 1) * span / TILE_SIZE
+    return tx * span, tx * span + last, ty * span, ty * span + last
+
+
+def tile_samples(level, tx, ty):
+    xmin, xmax, ymin, ymax = tile_bounds(level, tx, ty)
+    return np.linspace(xmin, xmax, TILE_SIZE), np.linspace(ymin, ymax, TILE_SIZE)
+
+
+def tile_key(level, tx, ty, maxiter):
+    # Cache and store key of a tile, with the precision it is computed in resolved, so that tiles
+    # of different precisions are never mixed
+    return level, tx, ty, maxiter, resolve_precision(None, *tile_bounds(level, tx, ty), TILE_SIZE, TILE_SIZE)
+
+
+def tile_passes(level, tx, ty, maxiter, strides=(1,), is_cancelled=None):
+    # Computes a tile in the progressive passes of strides and yields it after every pass, computed
+    # on the lattice of that stride so far (see preview), the last one being the whole tile. Every
+    # tile is computed through here, so that a tile is the same whether it was rendered
+    # progressively or not.
+    r1, r2 = tile_samples(level, tx, ty)
+    precision = tile_key(level, tx, ty, maxiter)[-1]
+    n3 = np.empty((TILE_SIZE, TILE_SIZE), dtype=count_dtype(maxiter))
+    coarser = 0
+    for stride in strides:
+        mandelbrot_pass(r1, r2, maxiter, n3, stride, coarser, is_cancelled=is_cancelled, precision=precision)
+        coarser = stride
+        yield n3
+
+
+def compute_tile(level, tx, ty, maxiter):
+    for n3 in tile_passes(level, tx, ty, maxiter):
+        pass
+    return n3
+
+
+def _lookup(key, cache, store):
+    # Tile from memory or else from disk, promoting it into memory
+    tile = cache.get(key)
+    if tile is None and store is not None:
+        tile = store.get(key)
+        if tile is not None:
+            cache.put(key, tile)
+    return tile
+
+
+def _store(key, tile, cache, store):
+    cache.put(key, tile)
+    if store is not None:
+        store.put(key, tile)
+
+
+def get_tile(level, tx, ty, maxiter, cache=None, store=False):
+    # store=False uses default_store, pass None to keep the tile in memory only
+    cache = default_cache if cache is None else cache
+    store = default_store if store is False else store
+    key = tile_key(level, tx, ty, maxiter)
+    tile = _lookup(key, cache, store)
+    if tile is None:
+        tile = compute_tile(level, tx, ty, maxiter)
+        _store(key, tile, cache, store)
+    return tile
+
+
+def _tile_grid(xmin, xmax, ymin, ymax, width, height):
+    # Zoom level of the view and the tile lattice index of the nearest lattice point of every sample,
+    # tile (tx, ty) holding the indices tx * TILE_SIZE ... on the first axis and ty * TILE_SIZE ... on
+    # the second
+    r1 = np.linspace(xmin, xmax, width)
+    r2 = np.linspace(ymin, ymax, height)
+    spacing = min((xmax - xmin) / max(width - 1, 1), (ymax - ymin) / max(height - 1, 1))
+    level = tile_level(spacing)
+    lattice = BASE_SPAN / 2**level / TILE_SIZE
+    return r1, r2, level, np.rint(r1 / lattice).astype(np.int64), np.rint(r2 / lattice).astype(np.int64)
+
+
+def _tile_range(indices):
+    return range(int(indices[0]) // TILE_SIZE, int(indices[-1]) // TILE_SIZE + 1)
+
+
+def _assemble(tiles, ix, iy, strides=None):
+    # Gathers every sample from its nearest lattice point. Tiles given a stride in strides are only
+    # computed on the lattice of that stride so far, their samples take the corner of their
+    # stride x stride block as in preview.
+    n3 = None
+    for (tx, ty), tile in tiles.items():
+        if n3 is None:
+            n3 = np.empty((ix.shape[0], iy.shape[0]), dtype=tile.dtype)
+        stride = 1 if strides is None else strides.get((tx, ty), 1)
+        x0, x1 = np.searchsorted(ix, [tx * TILE_SIZE, (tx + 1) * TILE_SIZE])
+        y0, y1 = np.searchsorted(iy, [ty * TILE_SIZE, (ty + 1) * TILE_SIZE])
+        # Rows then columns, much faster than one gather through np.ix_
+        rows = tile[(ix[x0:x1] - tx * TILE_SIZE) // stride * stride]
+        n3[x0:x1, y0:y1] = rows[:, (iy[y0:y1] - ty * TILE_SIZE) // stride * stride]
+    return n3
+
+
+def render_tiles(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500, cache=None, store=False,
+                 is_cancelled=None):
+    # Same output as mandelbrot_set, except that every sample is snapped to the nearest sample of
+    # the tile lattice at the matching zoom level.
+    r1, r2, level, ix, iy = _tile_grid(xmin, xmax, ymin, ymax, width, height)
+
+    tiles = {}
+    for tx in _tile_range(ix):
+        for ty in _tile_range(iy):
+            if is_cancelled is not None and is_cancelled():
+                raise RenderCancelled()
+            tiles[tx, ty] = get_tile(level, tx, ty, maxiter, cache, store)
+    return r1, r2, _assemble(tiles, ix, iy)
+
+
+def render_tiles_progressive(xmin, xmax, ymin, ymax, maxiter=250, width=1500, height=1500, cache=None, store=False,
+                             strides=None, is_cancelled=None):
+    # Like render_tiles, but the missing tiles are computed in progressive passes and the view is
+    # yielded after every pass. Yields the final view only when every tile is cached.
+    cache = default_cache if cache is None else cache
+    store = default_store if store is False else store
+    strides = PREVIEW_STRIDES if strides is None else strides
+    r1, r2, level, ix, iy = _tile_grid(xmin, xmax, ymin, ymax, width, height)
+
+    tiles, missing = {}, {}
+    for tx in _tile_range(ix):
+        for ty in _tile_range(iy):
+            key = tile_key(level, tx, ty, maxiter)
+            tile = _lookup(key, cache, store)
+            if tile is None:
+                missing[tx, ty] = (key, tile_passes(level, tx, ty, maxiter, strides, is_cancelled))
+            else:
+                tiles[tx, ty] = tile
+
+    if not missing:
+        yield r1, r2, _assemble(tiles, ix, iy)
+        return
+
+    # Every missing tile advances by one pass before the view is yielded
+    for stride in strides:
+        for (tx, ty), (_, passes) in missing.items():
+            tiles[tx, ty] = next(passes)
+        if stride == 1:
+            for (tx, ty), (key, _) in missing.items():
+                _store(key, tiles[tx, ty], cache, store)
+        yield r1, r2, _assemble(tiles, ix, iy, dict.fromkeys(missing, stride))
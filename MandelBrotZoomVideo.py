@@ -0,0 +1,234 @@
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal, localcontext, ROUND_CEILING, ROUND_FLOOR
+
+import numpy as np
+import numba
+
+from MandelBrotEngine import mandelbrot_set, WORKERS
+from MandelBrotDeepZoom import deep_mandelbrot_set, needs_deep_zoom, orbit_digits
+from MandelBrotImage import palette, encode_png
+
+# Consecutive frames are rendered from one keyframe: the union of their views sampled at the
+# spacing of the finest of them, on a lattice through its first sample. Every frame is resampled
+# from it at the nearest sample, within half a sample of its own, the finest frame exactly. A group
+# ends before its scales span more than KEYFRAME_ZOOM or its keyframe grows past KEYFRAME_ZOOM
+# frames on either axis, so zooms compute about KEYFRAME_ZOOM**2 frames of samples for every
+# KEYFRAME_ZOOM of zoom and holds and pans little more than the newly exposed strips.
+KEYFRAME_ZOOM = 2
+
+# Frames of a group at most. A group is rendered by one worker process, so longer groups reuse more
+# and balance worse.
+FRAMES_PER_CHUNK = 24
+
+# Counts are colored on a fixed scale so that colors do not flicker between frames
+COLOR_GAMMA = 0.5
+
+#######################################################################################################################
+
+
+def frame_views(keyframes, fps=30, width=1920, height=1080):
+    # Keyframes are (time in seconds, center real, center imaginary, view width), the center may be
+    # given as strings or Decimals to reach past float64. The view width is interpolated
+    # geometrically and the center in proportion to the zoom, so the target of a zoom stays put on
+    # screen. Returns the bounds of every frame as Decimals.
+    keyframes = sorted(keyframes, key=lambda keyframe: float(keyframe[0]))
+    smallest = min(float(scale) for _, _, _, scale in keyframes)
+    with localcontext() as ctx:
+        ctx.prec = orbit_digits(smallest / max(width - 1, 1))
+        keys = [(Decimal(str(t)), Decimal(re), Decimal(im), Decimal(scale)) for t, re, im, scale in keyframes]
+        aspect = Decimal(height) / Decimal(width)
+        count = int(round(float(keys[-1][0]) * fps)) + 1
+
+        views = []
+        k = 0
+        for frame in range(count):
+            t = Decimal(frame) / Decimal(fps)
+            while k < len(keys) - 2 and t > keys[k + 1][0]:
+                k += 1
+            (t0, re0, im0, s0), (t1, re1, im1, s1) = keys[k], keys[min(k + 1, len(keys) - 1)]
+            u = min(max((t - t0) / (t1 - t0), Decimal(0)), Decimal(1)) if t1 > t0 else Decimal(1)
+            scale = s0 * (s1 / s0) ** u
+            w = (s0 - scale) / (s0 - s1) if s0 != s1 else u
+            re, im = re0 + (re1 - re0) * w, im0 + (im1 - im0) * w
+            views.append((re - scale / 2, re + scale / 2, im - scale * aspect / 2, im + scale * aspect / 2))
+    return views
+
+
+def frame_indices(n3, maxiter):
+    # Palette indices of the counts on the fixed scale (n / maxiter)**COLOR_GAMMA, image rows top first
+    indices = (np.power(n3.astype(np.float32) / maxiter, COLOR_GAMMA) * 255).round().astype(np.uint8)
+    return np.ascontiguousarray(indices.T[::-1])
+
+
+def _init_worker(threads):
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+
+def keyframe(views, width=1920, height=1080):
+    # Bounds and sample counts (xmin, xmax, ymin, ymax, width, height) of the keyframe of views, the
+    # bounds as Decimals
+    finest = min(views, key=lambda view: view[1] - view[0])
+    x_step = (finest[1] - finest[0]) / max(width - 1, 1)
+    y_step = (finest[3] - finest[2]) / max(height - 1, 1)
+    with localcontext() as ctx:
+        ctx.prec = orbit_digits(float(min(x_step, y_step)))
+        bounds, counts = [], []
+        for lo, hi, first, step in [(0, 1, finest[0], x_step), (2, 3, finest[2], y_step)]:
+            k0 = ((min(view[lo] for view in views) - first) / step).to_integral_value(ROUND_FLOOR)
+            k1 = ((max(view[hi] for view in views) - first) / step).to_integral_value(ROUND_CEILING)
+            bounds += [first + k0 * step, first + k1 * step]
+            counts.append(int(k1 - k0) + 1)
+    return tuple(bounds) + tuple(counts)
+
+
+def keyframe_groups(views, width=1920, height=1080, keyframe_zoom=KEYFRAME_ZOOM, chunk=FRAMES_PER_CHUNK):
+    # Splits views into runs of consecutive frames rendered from one keyframe (see KEYFRAME_ZOOM).
+    # Returns the index of the first frame, the number of frames and the keyframe of every run.
+    groups = []
+    first = 0
+    while first < len(views):
+        count = 1
+        key = keyframe(views[first:first + 1], width, height)
+        while count < chunk and first + count < len(views):
+            scales = [view[1] - view[0] for view in views[first:first + count + 1]]
+            larger = keyframe(views[first:first + count + 1], width, height)
+            if (max(scales) > keyframe_zoom * min(scales) or larger[4] > keyframe_zoom * width
+                    or larger[5] > keyframe_zoom * height):
+                break
+            count, key = count + 1, larger
+        groups.append((first, count, key))
+        first += count
+    return groups
+
+
+def render_keyframe(key, maxiter=1000, threads=None):
+    # threads defaults to the numba threads of the calling thread, as set by _init_worker in the
+    # workers, rather than to MandelBrotEngine.WORKERS
+    xmin, xmax, ymin, ymax, width, height = key
+    threads = numba.get_num_threads() if threads is None else threads
+    if needs_deep_zoom(xmin, xmax, ymin, ymax, width, height):
+        _, _, n3 = deep_mandelbrot_set(xmin, xmax, ymin, ymax, maxiter=maxiter, width=width, height=height)
+    else:
+        _, _, n3 = mandelbrot_set(float(xmin), float(xmax), float(ymin), float(ymax), maxiter=maxiter, width=width,
+                                  height=height, workers=threads)
+    return n3
+
+
+def _nearest(lo, hi, count, key_lo, key_hi, key_count):
+    # Index of the keyframe sample nearest to each of count samples from lo to hi. The offsets are
+    # taken in Decimal, which keeps deep zooms apart, and are small enough for float64 after.
+    with localcontext() as ctx:
+        ctx.prec = orbit_digits(float((key_hi - key_lo) / max(key_count - 1, 1)))
+        step = (key_hi - key_lo) / max(key_count - 1, 1)
+        offset = float((lo - key_lo) / step)
+        stride = float((hi - lo) / max(count - 1, 1) / step)
+    return np.clip(np.rint(offset + stride * np.arange(count)), 0, key_count - 1).astype(np.int64)
+
+
+def resample(n3, key, view, width=1920, height=1080):
+    # Counts of view from the counts n3 of its keyframe key
+    xmin, xmax, ymin, ymax = view
+    ix = _nearest(xmin, xmax, width, key[0], key[1], key[4])
+    iy = _nearest(ymin, ymax, height, key[2], key[3], key[5])
+    return n3[ix][:, iy]
+
+
+def _render_group(first, views, key, directory, fmt, width, height, maxiter):
+    # Renders the keyframe of frames first, first + 1, ... of views and writes them out one at a
+    # time. Returns the number of samples computed and the number of samples of the frames.
+    paths = [os.path.join(directory, 'frame_%06d.png' % index) for index in range(first, first + len(views))]
+    if fmt == 'png' and all(os.path.exists(path) for path in paths):
+        # Left over from an interrupted run
+        return 0, len(views) * width * height
+    n3 = render_keyframe(key, maxiter)
+    colors = palette()
+    for index, path, view in zip(range(first, first + len(views)), paths, views):
+        if fmt == 'png' and os.path.exists(path):
+            continue
+        indices = frame_indices(resample(n3, key, view, width, height), maxiter)
+        if fmt == 'png':
+            temporary = path + '.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(encode_png(indices, colors))
+            os.replace(temporary, path)
+        else:
+            with open(os.path.join(directory, 'zoom.rgb'), 'r+b') as f:
+                f.seek(index * width * height * 3)
+                f.write(colors[indices].tobytes())
+    return n3.size, len(views) * width * height
+
+
+def render_zoom(keyframes, directory, fps=30, width=1920, height=1080, maxiter=1000, fmt='png', processes=None,
+                threads=1, chunk=None, keyframe_zoom=None, progress=None):
+    # Renders the zoom along keyframes (see frame_views) into directory, either as numbered palette
+    # PNGs frame_000000.png, ... or as a single file zoom.rgb of raw rgb24 frames for ffmpeg
+    # (-f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT -r FPS -i zoom.rgb). Groups of at most chunk
+    # consecutive frames (see keyframe_groups) are rendered by a pool of processes with threads numba
+    # threads each. progress(done, total) is called after every group. Returns the number of samples
+    # computed as a fraction of the samples of the frames.
+    processes = WORKERS if processes is None else processes
+    chunk = FRAMES_PER_CHUNK if chunk is None else chunk
+    keyframe_zoom = KEYFRAME_ZOOM if keyframe_zoom is None else keyframe_zoom
+    if fmt not in ('png', 'raw'):
+        raise ValueError("Unknown format %r, expected 'png' or 'raw'" % fmt)
+
+    views = frame_views(keyframes, fps, width, height)
+    os.makedirs(directory, exist_ok=True)
+    if fmt == 'raw':
+        with open(os.path.join(directory, 'zoom.rgb'), 'wb') as f:
+            f.truncate(len(views) * width * height * 3)
+
+    # Workers are spawned rather than forked, numba's thread pool does not survive a fork
+    computed, total, done = 0, 0, 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                             initargs=(threads,)) as pool:
+        futures = {pool.submit(_render_group, first, views[first:first + count], key, directory, fmt, width, height,
+                               maxiter): count
+                   for first, count, key in keyframe_groups(views, width, height, keyframe_zoom, chunk)}
+        for future in as_completed(futures):
+            chunk_computed, chunk_total = future.result()
+            computed += chunk_computed
+            total += chunk_total
+            done += futures[future]
+            if progress is not None:
+                progress(done, len(views))
+    return computed / max(total, 1)
+
+#######################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders a Mandelbrot zoom along keyframes to numbered PNGs or raw '
+                                                 'rgb24 video.')
+    parser.add_argument('directory')
+    parser.add_argument('--keyframes', help='JSON list of [time, center real, center imaginary, view width], '
+                                            'centers may be strings for deep zooms')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--maxiter', type=int, default=1000)
+    parser.add_argument('--format', default='png', choices=['png', 'raw'])
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--keyframe-zoom', type=float, default=None,
+                        help='zoom factor spanned by the frames rendered from one keyframe')
+    args = parser.parse_args()
+
+    if args.keyframes:
+        with open(args.keyframes) as f:
+            keyframes = json.load(f)
+    else:
+        # Into the seahorse valley
+        keyframes = [(0, -0.75, 0.0, 3.5), (20, '-0.743643887037151', '0.131825904205330', 1e-10)]
+
+    def report(done, total):
+        print('%d / %d frames' % (done, total))
+
+    fraction = render_zoom(keyframes, args.directory, fps=args.fps, width=args.width, height=args.height,
+                           maxiter=args.maxiter, fmt=args.format, processes=args.processes,
+                           keyframe_zoom=args.keyframe_zoom, progress=report)
+    print('computed %.1f%% of the samples' % (100 * fraction))
@@ -0,0 +1,489 @@
+import math
+
+import numpy as np
+from numba import jit, prange, get_num_threads
+
+from MandelBrotEngine import count_dtype
+
+# Compiled Mandelbulb distance estimation and sphere tracing shared by the MandelBulb scripts. The
+# kernels follow the array code these scripts used to carry.
+
+# Default march method: 'fused' marches every ray to the end in a single pass that keeps its state in
+# registers, 'compact' advances all rays one step at a time over a list of the active rays that is
+# compacted after every step, which keeps the threads evenly loaded when the costly rays through the
+# bulb are bunched together.
+METHOD = 'fused'
+
+# Rays are clipped to a sphere around the bulb: they start marching where they enter it and count as
+# misses once they leave it. Every point of the degree n bulb lies within 2**(1 / (n - 1)) of the
+# origin, BOUND_MARGIN leaves room for hits registered a little outside the surface.
+BOUND_MARGIN = 0.1
+
+# Voxel volumes are computed SLAB_VOXELS voxels at a time, in slabs of whole x planes
+SLAB_VOXELS = 2**24
+
+#######################################################################################################################
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _complex_power(re, im, n):
+    # (re + i im)**n for an integer n >= 1 by repeated squaring, three squarings for n = 8 and one
+    # more multiplication for n = 9
+    pr, pi = 1.0, 0.0
+    while n > 0:
+        if n & 1:
+            pr, pi = pr*re - pi*im, pr*im + pi*re
+        n >>= 1
+        if n > 0:
+            re, im = re*re - im*im, 2.0*re*im
+    return pr, pi
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _power(x, y, z, n):
+    # Power n of (x, y, z) for an integer n >= 1, the point at r**n and n times the angles of
+    # (x, y, z), without trigonometry (see distance_estimator)
+    rho = math.sqrt(x*x + y*y)
+    zr_cos, zr_sin = _complex_power(z, rho, n)
+    if rho > 0.0:
+        cos_phi, sin_phi = _complex_power(x / rho, y / rho, n)
+    else:
+        # On the z axis phi = atan2(0, 0) = 0
+        cos_phi, sin_phi = 1.0, 0.0
+    return zr_sin * cos_phi, zr_sin * sin_phi, zr_cos
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _trig_power(x, y, z, degree):
+    # Power of (x, y, z) for any degree through the angles
+    r = math.sqrt(x*x + y*y + z*z)
+    theta = math.atan2(math.sqrt(x*x + y*y), z) * degree
+    phi = math.atan2(y, x) * degree
+    zr = r ** degree
+    return zr * math.sin(theta) * math.cos(phi), zr * math.sin(theta) * math.sin(phi), zr * math.cos(theta)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _trig_distance_estimator(x0, y0, z0, iterations, degree, bailout):
+    x, y, z = 0.0, 0.0, 0.0
+    dr = 1.0
+    r = 0.0
+    for _ in range(iterations):
+        r = math.sqrt(x*x + y*y + z*z)
+        if not r < bailout:
+            break
+        dr = r ** (degree - 1) * degree * dr + 1.0
+
+        theta = math.atan2(math.sqrt(x*x + y*y), z) * degree
+        phi = math.atan2(y, x) * degree
+        zr = r ** degree
+
+        x = zr * math.sin(theta) * math.cos(phi) + x0
+        y = zr * math.sin(theta) * math.sin(phi) + y0
+        z = zr * math.cos(theta) + z0
+
+    return 0.5 * math.log(r) * r / dr
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def distance_estimator(x0, y0, z0, iterations, degree=8, bailout=1000, trig=False):
+    # Distance estimate 0.5 * log(r) * r / dr of the point (x0, y0, z0). Like the array version r is
+    # the radius at the start of the last iteration, and iterating stops for good at the first
+    # radius reaching bailout. Integer degrees skip the trigonometry: with rho = sqrt(x*x + y*y),
+    # r**n (cos(n theta), sin(n theta)) is (z + i rho)**n and (cos(n phi), sin(n phi)) is
+    # ((x + i y) / rho)**n. Other degrees, and trig=True, take the angles as before.
+    n = int(degree)
+    if trig or n != degree or n < 1:
+        return _trig_distance_estimator(x0, y0, z0, iterations, degree, bailout)
+
+    x, y, z = 0.0, 0.0, 0.0
+    dr = 1.0
+    r = 0.0
+    for _ in range(iterations):
+        r = math.sqrt(x*x + y*y + z*z)
+        if not r < bailout:
+            break
+        dr = r ** (n - 1) * n * dr + 1.0
+
+        x, y, z = _power(x, y, z, n)
+        x += x0
+        y += y0
+        z += z0
+
+    return 0.5 * math.log(r) * r / dr
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def DistanceEstimator(positions, iterations, degree=8, bailout=1000, trig=False):
+    # Distance estimates of an (n, 3) array of positions
+    distance = np.empty(positions.shape[0])
+    for k in prange(positions.shape[0]):
+        distance[k] = distance_estimator(positions[k, 0], positions[k, 1], positions[k, 2], iterations, degree,
+                                         bailout, trig)
+    return distance
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def lattice_distances(indices, origin, spacing, iterations, degree=8, bailout=1000):
+    # Distance estimates at origin + indices * spacing of an (n, 3) array of integer lattice indices
+    distance = np.empty(indices.shape[0])
+    for k in prange(indices.shape[0]):
+        distance[k] = distance_estimator(origin + indices[k, 0]*spacing, origin + indices[k, 1]*spacing,
+                                         origin + indices[k, 2]*spacing, iterations, degree, bailout)
+    return distance
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _clip(start, dx, dy, dz, radius):
+    # Distances along the ray at which it enters and leaves the sphere of the given radius around
+    # the origin, entry after exit if it misses the sphere. The ray starts at start.
+    b = start[0]*dx + start[1]*dy + start[2]*dz
+    c = start[0]*start[0] + start[1]*start[1] + start[2]*start[2] - radius*radius
+    discriminant = b*b - c
+    if discriminant < 0:
+        return 1.0, 0.0
+    root = math.sqrt(discriminant)
+    return max(0.0, -b - root), -b + root
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _march_ray(start, dx, dy, dz, max_steps, min_distance, iterations, degree, bailout, radius):
+    # Distance travelled, steps taken, distance estimates evaluated and whether the ray hit, see march
+    travelled, leave = _clip(start, dx, dy, dz, radius)
+    n = 0
+    m = 0
+    hit = False
+    if travelled <= leave:
+        for _ in range(max_steps):
+            distance = distance_estimator(start[0] + travelled*dx, start[1] + travelled*dy, start[2] + travelled*dz,
+                                          iterations, degree, bailout)
+            m += 1
+            if distance < min_distance:
+                hit = True
+                break
+            travelled += distance
+            n += 1
+            if travelled > leave:
+                break
+    if not hit and travelled > leave:
+        return np.inf, max_steps, m, False
+    return travelled, n, m, hit
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _march(start, directions, max_steps, min_distance, iterations, degree, bailout, radius, total_distance, steps,
+           hit, evaluated):
+    for k in prange(directions.shape[0]):
+        total_distance[k], steps[k], evaluated[k], hit[k] = _march_ray(start, directions[k, 0], directions[k, 1],
+                                                                       directions[k, 2], max_steps, min_distance,
+                                                                       iterations, degree, bailout, radius)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _clip_rays(start, directions, radius, total_distance, leave):
+    for k in prange(directions.shape[0]):
+        total_distance[k], leave[k] = _clip(start, directions[k, 0], directions[k, 1], directions[k, 2], radius)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _march_step(start, directions, active, min_distance, iterations, degree, bailout, total_distance, steps, hit,
+                leave, done):
+    # One step of every ray in active
+    for a in prange(active.shape[0]):
+        k = active[a]
+        t = total_distance[k]
+        distance = distance_estimator(start[0] + t*directions[k, 0], start[1] + t*directions[k, 1],
+                                      start[2] + t*directions[k, 2], iterations, degree, bailout)
+        if distance < min_distance:
+            hit[k] = True
+            done[k] = True
+        else:
+            total_distance[k] = t + distance
+            steps[k] += 1
+            done[k] = t + distance > leave[k]
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _camera_ray(observer, u, v, eps):
+    # Direction from the observer to the point (u, v) of the plane through the origin normal to
+    # the observer position, in the coordinates of the MandelBulb scripts' get_plane_points
+    a, b, c = observer[0], observer[1], observer[2]
+    if abs(c) > eps:
+        x, y, z = u, v, -(a*u + b*v)/c
+    elif abs(a) > eps:
+        x, y, z = -(c*u + b*v)/a, v, u
+    else:
+        x, y, z = u, -(a*u + c*v)/b, v
+    x, y, z = x - a, y - b, z - c
+    norm = math.sqrt(x*x + y*y + z*z)
+    return x/norm, y/norm, z/norm
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _capture(observers, us, vs, max_steps, min_distance, iterations, degree, bailout, radius, eps, total_distance,
+             hit):
+    # Marches the rays of every pixel of every view, ray k is pixel k % pixels of view k // pixels
+    pixels = us.shape[0] * vs.shape[0]
+    for k in prange(observers.shape[0] * pixels):
+        observer = observers[k // pixels]
+        pixel = k % pixels
+        dx, dy, dz = _camera_ray(observer, us[pixel % us.shape[0]], vs[pixel // us.shape[0]], eps)
+        total_distance[k], _, _, hit[k] = _march_ray(observer, dx, dy, dz, max_steps, min_distance, iterations,
+                                                     degree, bailout, radius)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _capture_points(observers, us, vs, eps, total_distance, rays, points, views):
+    # Hit points of the given rays of _capture
+    pixels = us.shape[0] * vs.shape[0]
+    for i in prange(rays.shape[0]):
+        k = rays[i]
+        observer = observers[k // pixels]
+        pixel = k % pixels
+        dx, dy, dz = _camera_ray(observer, us[pixel % us.shape[0]], vs[pixel // us.shape[0]], eps)
+        t = total_distance[k]
+        points[i, 0] = observer[0] + t*dx
+        points[i, 1] = observer[1] + t*dy
+        points[i, 2] = observer[2] + t*dz
+        views[i] = k // pixels
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _rotate(a, b, c, rotation, center):
+    x, y, z = a - center[0], b - center[1], c - center[2]
+    return (rotation[0, 0]*x + rotation[0, 1]*y + rotation[0, 2]*z + center[0],
+            rotation[1, 0]*x + rotation[1, 1]*y + rotation[1, 2]*z + center[1],
+            rotation[2, 0]*x + rotation[2, 1]*y + rotation[2, 2]*z + center[2])
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _escape_count(cx, cy, cz, degree, maxiter, escape2):
+    # Iterates of z -> z**degree + c from z = c before |z|**2 exceeds escape2, maxiter if none does
+    n = int(degree)
+    integer = n == degree and n >= 1
+    x, y, z = cx, cy, cz
+    for i in range(maxiter):
+        if integer:
+            x, y, z = _power(x, y, z, n)
+        else:
+            x, y, z = _trig_power(x, y, z, degree)
+        x += cx
+        y += cy
+        z += cz
+        if x*x + y*y + z*z > escape2:
+            return i
+    return maxiter
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _voxel_slab(first, xs, ys, zs, rotation, center, degree, maxiter, escape2, interior2, out):
+    # Escape counts of the x planes first, first + 1, ... of the lattice into out, see voxel_counts
+    planes, rows, columns = out.shape
+    for k in prange(planes * rows):
+        a = xs[first + k // rows]
+        b = ys[k % rows]
+        for kz in range(columns):
+            c = zs[kz]
+            if a*a + b*b + c*c < interior2:
+                out[k // rows, k % rows, kz] = maxiter
+                continue
+            cx, cy, cz = _rotate(a, b, c, rotation, center)
+            out[k // rows, k % rows, kz] = _escape_count(cx, cy, cz, degree, maxiter, escape2)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _orbit_histograms(xs, ys, zs, rotation, center, degree, maxiter, escape2, interior2, lower, scale, escaped_only,
+                      partial):
+    # Bins the iterates of every lattice point that have not escaped into partial[chunk], one
+    # histogram per chunk of interleaved rows so that chunks never write the same histogram
+    n = int(degree)
+    integer = n == degree and n >= 1
+    chunks, bins_x, bins_y, bins_z = partial.shape
+    rows = ys.shape[0]
+    for chunk in prange(chunks):
+        for k in range(chunk, xs.shape[0] * rows, chunks):
+            a = xs[k // rows]
+            b = ys[k % rows]
+            for kz in range(zs.shape[0]):
+                c = zs[kz]
+                if a*a + b*b + c*c < interior2:
+                    continue
+                cx, cy, cz = _rotate(a, b, c, rotation, center)
+                if escaped_only and _escape_count(cx, cy, cz, degree, maxiter, escape2) == maxiter:
+                    continue
+                x, y, z = cx, cy, cz
+                for _ in range(maxiter):
+                    if integer:
+                        x, y, z = _power(x, y, z, n)
+                    else:
+                        x, y, z = _trig_power(x, y, z, degree)
+                    x += cx
+                    y += cy
+                    z += cz
+                    if x*x + y*y + z*z > escape2:
+                        break
+                    i = int(math.floor((x - lower[0]) * scale[0]))
+                    j = int(math.floor((y - lower[1]) * scale[1]))
+                    l = int(math.floor((z - lower[2]) * scale[2]))
+                    if 0 <= i < bins_x and 0 <= j < bins_y and 0 <= l < bins_z:
+                        partial[chunk, i, j, l] += 1
+
+
+def bounding_radius(degree):
+    # Radius of the sphere rays are clipped to, see BOUND_MARGIN
+    if degree <= 1:
+        return np.inf
+    return 2 ** (1 / (degree - 1)) + BOUND_MARGIN
+
+#######################################################################################################################
+
+
+def march(start, directions, max_steps, min_distance, iterations, degree=8, bailout=1000, radius=None, method=None,
+          profile=False):
+    # Sphere traces every ray start + t * directions[k] until the distance estimate drops below
+    # min_distance, max_steps steps were taken or the ray left the sphere of the given radius
+    # (bounding_radius(degree) by default, np.inf to march unclipped). Returns the distance
+    # travelled, the number of steps taken and whether the ray hit, for every ray. The step on which
+    # a ray hits is not counted, rays that miss the sphere or leave it get an infinite distance and
+    # max_steps steps. With profile the number of rays still marching at every step is returned
+    # fourth.
+    method = METHOD if method is None else method
+    radius = bounding_radius(degree) if radius is None else radius
+    start = np.ascontiguousarray(start, dtype=np.float64)
+    directions = np.ascontiguousarray(directions, dtype=np.float64)
+    total_distance = np.zeros(directions.shape[0])
+    steps = np.zeros(directions.shape[0])
+    hit = np.zeros(directions.shape[0], dtype=np.bool_)
+
+    if method == 'fused':
+        evaluated = np.zeros(directions.shape[0], dtype=np.int64)
+        _march(start, directions, max_steps, min_distance, iterations, degree, bailout, radius, total_distance, steps,
+               hit, evaluated)
+        active = np.bincount(evaluated, minlength=max_steps + 1)[::-1].cumsum()[::-1][1:]
+    elif method == 'compact':
+        leave = np.empty(directions.shape[0])
+        done = np.zeros(directions.shape[0], dtype=np.bool_)
+        _clip_rays(start, directions, radius, total_distance, leave)
+        indices = np.flatnonzero(total_distance <= leave)
+        active = np.zeros(max_steps, dtype=np.int64)
+        for step in range(max_steps):
+            if indices.shape[0] == 0:
+                break
+            active[step] = indices.shape[0]
+            _march_step(start, directions, indices, min_distance, iterations, degree, bailout, total_distance, steps,
+                        hit, leave, done)
+            indices = indices[~done[indices]]
+        missed = ~hit & (total_distance > leave)
+        total_distance[missed] = np.inf
+        steps[missed] = max_steps
+    else:
+        raise ValueError("Unknown method %r, expected 'fused' or 'compact'" % method)
+
+    if profile:
+        return total_distance, steps, hit, active
+    return total_distance, steps, hit
+
+
+def voxel_filter(points, size):
+    # Index of the first of the points in every occupied cube of a grid of the given size, in order
+    cells = np.floor(points / size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    if cells.max() >= 2**21:
+        # Too many cells across to pack, the rows are compared instead
+        _, first = np.unique(cells, axis=0, return_index=True)
+        return np.sort(first)
+    # Packs the three cell coordinates into one key, 21 bits each
+    keys = (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(first)
+
+
+def capture(observers, width=250, height=250, span=(1.5, 1.5), center=(0, 0), zoom=0, max_steps=32, min_distance=5e-3,
+            iterations=32, degree=8, bailout=32000, radius=None, voxel=None, eps=1e-4):
+    # Point cloud of the bulb as seen from every observer position, in one parallel pass over the
+    # rays of all views. Every view looks at the origin through a width x height grid spanning
+    # center +- span / 2**zoom on the plane through the origin normal to the observer, like the
+    # MandelBulb scripts. Returns the (n, 3) hit points and the index of the observer that saw
+    # each, ordered by view and pixel. With voxel the points are thinned to the first of every
+    # voxel x voxel x voxel cube, which merges the surface seen by overlapping views.
+    observers = np.ascontiguousarray(np.atleast_2d(observers), dtype=np.float64)
+    if np.any(np.abs(observers).max(axis=1) <= eps):
+        raise ValueError('Observers must be away from the origin')
+    radius = bounding_radius(degree) if radius is None else radius
+    us = np.linspace(center[0] - span[0] / 2.**zoom, center[0] + span[0] / 2.**zoom, width)
+    vs = np.linspace(center[1] - span[1] / 2.**zoom, center[1] + span[1] / 2.**zoom, height)
+
+    rays = observers.shape[0] * width * height
+    total_distance = np.empty(rays)
+    hit = np.empty(rays, dtype=np.bool_)
+    _capture(observers, us, vs, max_steps, min_distance, iterations, degree, bailout, radius, eps, total_distance, hit)
+
+    rays = np.flatnonzero(hit)
+    points = np.empty((rays.shape[0], 3))
+    views = np.empty(rays.shape[0], dtype=np.int64)
+    _capture_points(observers, us, vs, eps, total_distance, rays, points, views)
+    if voxel is not None:
+        first = voxel_filter(points, voxel)
+        points, views = points[first], views[first]
+    return points, views
+
+
+def rotation_matrix(xy, xz, yz):
+    # Rotation by xy in the xy plane, then by xz in the xz plane, then by yz in the yz plane
+    sxy, cxy, sxz, cxz, syz, cyz = np.sin(xy), np.cos(xy), np.sin(xz), np.cos(xz), np.sin(yz), np.cos(yz)
+    rotate_xy = np.array([[cxy, -sxy, 0], [sxy, cxy, 0], [0, 0, 1]])
+    rotate_xz = np.array([[cxz, 0, -sxz], [0, 1, 0], [sxz, 0, cxz]])
+    rotate_yz = np.array([[1, 0, 0], [0, cyz, -syz], [0, syz, cyz]])
+    return rotate_yz @ rotate_xz @ rotate_xy
+
+
+def voxel_counts(resolution=(35, 35, 35), bounds=((-1.5, 1.5), (-1.5, 1.5), (-1.5, 1.5)), degree=4, maxiter=255,
+                 escape=3.5, angles=(0, 0, 0), interior_radius=0.5, path=None):
+    # Escape counts of the lattice of resolution points over bounds, each point c rotated by angles
+    # (see rotation_matrix) about the center of bounds and iterated as z -> z**degree + c from
+    # z = c until |z|**2 exceeds escape. Counts are the number of iterates before escaping and
+    # maxiter for points that never do, in the smallest unsigned type holding maxiter. Points
+    # within interior_radius of the origin count as inside without iterating. Returns the lattice
+    # coordinates and the volume indexed [x, y, z], like mandelbrot_set. With path the volume is
+    # an .npy memory map written slab by slab, for volumes larger than memory.
+    lattice = [np.linspace(lo, hi, points) for (lo, hi), points in zip(bounds, resolution)]
+    center = np.array([(lo + hi) / 2 for lo, hi in bounds], dtype=np.float64)
+    rotation = rotation_matrix(*angles)
+    shape = tuple(resolution)
+    dtype = count_dtype(maxiter + 1)
+    if path is None:
+        volume = np.empty(shape, dtype=dtype)
+    else:
+        volume = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    planes = max(1, SLAB_VOXELS // (shape[1] * shape[2]))
+    for first in range(0, shape[0], planes):
+        slab = np.asarray(volume[first:first + planes])
+        _voxel_slab(first, lattice[0], lattice[1], lattice[2], rotation, center, degree, maxiter, escape,
+                    interior_radius ** 2, slab)
+        if path is not None:
+            volume.flush()
+    return lattice[0], lattice[1], lattice[2], volume
+
+
+def orbit_density(resolution=(35, 35, 35), bounds=((-1.5, 1.5), (-1.5, 1.5), (-1.5, 1.5)), degree=4, maxiter=255,
+                  escape=3.5, angles=(0, 0, 0), interior_radius=0.5, bins=(64, 64, 64), extent=None,
+                  escaped_only=False):
+    # Density of the orbits of the lattice points of voxel_counts: every iterate that has not
+    # escaped is counted in the bin of a bins histogram over extent (bounds by default) holding
+    # it, Buddhabrot style, and with escaped_only only the iterates of points that escape. Every
+    # thread fills its own histogram and these are summed at the end, so that memory grows with the
+    # bins and threads rather than with the iterates. Returns the bin centers along each axis and
+    # the counts indexed [x, y, z].
+    extent = bounds if extent is None else extent
+    lattice = [np.linspace(lo, hi, points) for (lo, hi), points in zip(bounds, resolution)]
+    center = np.array([(lo + hi) / 2 for lo, hi in bounds], dtype=np.float64)
+    lower = np.array([lo for lo, _ in extent], dtype=np.float64)
+    scale = np.array([count / (hi - lo) for (lo, hi), count in zip(extent, bins)], dtype=np.float64)
+
+    partial = np.zeros((get_num_threads(),) + tuple(bins), dtype=np.uint32)
+    _orbit_histograms(lattice[0], lattice[1], lattice[2], rotation_matrix(*angles), center, degree, maxiter,
+                      escape, interior_radius ** 2, lower, scale, escaped_only, partial)
+    density = partial.sum(axis=0, dtype=np.uint64)
+    centers = [lo + (np.arange(count) + 0.5) * (hi - lo) / count for (lo, hi), count in zip(extent, bins)]
+    return centers[0], centers[1], centers[2], density
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from MandelBulbEngine import capture
+from MandelBulbMesh import extract_mesh
+
+# Binary exports of Mandelbulb point clouds (faces=None) and meshes. The writers convert and write
+# CHUNK_ROWS vertices or faces at a time, so that beyond the arrays passed in, which may be
+# memory maps, a write only ever holds one chunk. Coordinates are written as float32 and vertex
+# indices as uint32. Files are written to a temporary name and renamed into place.
+CHUNK_ROWS = 2**18
+
+PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<u4', (3,))])
+STL_FACE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+#######################################################################################################################
+
+
+def _chunks(array):
+    for first in range(0, array.shape[0], CHUNK_ROWS):
+        yield array[first:first + CHUNK_ROWS]
+
+
+def _drop_collapsed(faces):
+    return faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+
+
+def weld(vertices, faces=None, tolerance=0.0):
+    # Merges the vertices that coincide, or with tolerance those in the same cube of that side, into
+    # the first of them. Returns the vertices and the faces over them without the faces that
+    # collapsed.
+    vertices = np.asarray(vertices)
+    keys = vertices if tolerance <= 0 else np.floor(vertices / tolerance).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    vertices = vertices[first]
+    if faces is None:
+        return vertices, None
+    return vertices, _drop_collapsed(inverse.reshape(-1)[np.asarray(faces)])
+
+
+def decimate(vertices, faces, cell):
+    # Quadric error vertex clustering (Lindstrom, Out-of-Core Simplification of Large Polygonal
+    # Models, 2000): the vertices in every cube of side cell become one, placed where the sum of the
+    # squared distances to the planes of their faces is smallest, or at their mean where that is
+    # ill-posed or outside the cube. Faces are read CHUNK_ROWS at a time, the memory grows with the
+    # vertices and the output only.
+    vertices = np.asarray(vertices)
+    cells = np.floor(vertices / cell).astype(np.int64)
+    keys, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    count = keys.shape[0]
+
+    # Quadrics of the clusters as the normal equations a x = -b of their minimum, summing
+    # area * n n^T and area * d n over the planes n x + d = 0 of the faces around them
+    a = np.zeros((count, 3, 3))
+    b = np.zeros((count, 3))
+    for chunk in _chunks(np.asarray(faces)):
+        p0, p1, p2 = vertices[chunk[:, 0]], vertices[chunk[:, 1]], vertices[chunk[:, 2]]
+        normal = np.cross(p1 - p0, p2 - p0)
+        area = np.linalg.norm(normal, axis=1)
+        normal /= np.maximum(area, np.finfo(float).tiny)[:, np.newaxis]
+        d = -np.sum(normal * p0, axis=1)
+        corners = cluster[chunk].reshape(-1)
+        for i in range(3):
+            b[:, i] += np.bincount(corners, np.repeat(area * d * normal[:, i], 3), minlength=count)
+            for j in range(i, 3):
+                weights = np.repeat(area * normal[:, i] * normal[:, j], 3)
+                a[:, i, j] += np.bincount(corners, weights, minlength=count)
+    a += np.triu(a, 1).transpose(0, 2, 1)
+
+    mean = np.stack([np.bincount(cluster, vertices[:, i], minlength=count) for i in range(3)], axis=1)
+    mean /= np.bincount(cluster, minlength=count)[:, np.newaxis]
+
+    scale = np.trace(a, axis1=1, axis2=2) / 3
+    solvable = np.abs(np.linalg.det(a)) > 1e-3 * scale**3
+    placed = mean.copy()
+    placed[solvable] = np.linalg.solve(a[solvable], -b[solvable][:, :, np.newaxis])[:, :, 0]
+    outside = np.any((placed < keys * cell) | (placed > (keys + 1) * cell), axis=1)
+    placed[outside] = mean[outside]
+
+    faces = _drop_collapsed(cluster[np.asarray(faces)])
+    # Clusters joined by several faces keep the first of them
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return placed, faces[np.sort(first)]
+
+#######################################################################################################################
+
+
+def write_ply(path, vertices, faces=None):
+    header = ['ply', 'format binary_little_endian 1.0', 'element vertex %d' % len(vertices),
+              'property float x', 'property float y', 'property float z']
+    if faces is not None:
+        header += ['element face %d' % len(faces), 'property list uchar uint vertex_indices']
+    header += ['end_header', '']
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write('\n'.join(header).encode('ascii'))
+        for chunk in _chunks(vertices):
+            f.write(np.ascontiguousarray(chunk, dtype='<f4').tobytes())
+        if faces is not None:
+            for chunk in _chunks(faces):
+                records = np.empty(len(chunk), dtype=PLY_FACE)
+                records['count'] = 3
+                records['indices'] = chunk
+                f.write(records.tobytes())
+    os.replace(temporary, path)
+
+
+def write_stl(path, vertices, faces):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(b'Mandelbulb'.ljust(80, b' '))
+        f.write(struct.pack('<I', len(faces)))
+        for chunk in _chunks(faces):
+            corners = np.asarray(vertices)[chunk]
+            normal = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+            normal /= np.maximum(np.linalg.norm(normal, axis=1), np.finfo(float).tiny)[:, np.newaxis]
+            records = np.zeros(len(chunk), dtype=STL_FACE)
+            records['normal'] = normal
+            records['vertices'] = corners
+            f.write(records.tobytes())
+    os.replace(temporary, path)
+
+
+def write_glb(path, vertices, faces=None):
+    # Binary glTF 2.0 holding one mesh, of triangles or with faces=None of points
+    lower = np.full(3, np.inf, dtype=np.float32)
+    upper = np.full(3, -np.inf, dtype=np.float32)
+    for chunk in _chunks(vertices):
+        chunk = np.asarray(chunk, dtype=np.float32)
+        lower = np.minimum(lower, chunk.min(axis=0))
+        upper = np.maximum(upper, chunk.max(axis=0))
+
+    positions = len(vertices) * 12
+    indices = 0 if faces is None else len(faces) * 12
+    primitive = {'attributes': {'POSITION': 0}, 'mode': 0 if faces is None else 4}
+    buffer_views = [{'buffer': 0, 'byteOffset': 0, 'byteLength': positions, 'target': 34962}]
+    accessors = [{'bufferView': 0, 'componentType': 5126, 'count': len(vertices), 'type': 'VEC3',
+                  'min': lower.tolist(), 'max': upper.tolist()}]
+    if faces is not None:
+        primitive['indices'] = 1
+        buffer_views.append({'buffer': 0, 'byteOffset': positions, 'byteLength': indices, 'target': 34963})
+        accessors.append({'bufferView': 1, 'componentType': 5125, 'count': len(faces) * 3, 'type': 'SCALAR'})
+    document = {'asset': {'version': '2.0'}, 'scene': 0, 'scenes': [{'nodes': [0]}], 'nodes': [{'mesh': 0}],
+                'meshes': [{'primitives': [primitive]}], 'buffers': [{'byteLength': positions + indices}],
+                'bufferViews': buffer_views, 'accessors': accessors}
+    document = json.dumps(document, separators=(',', ':')).encode()
+    document += b' ' * (-len(document) % 4)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(document) + 8 + positions + indices))
+        f.write(struct.pack('<II', len(document), 0x4E4F534A))
+        f.write(document)
+        f.write(struct.pack('<II', positions + indices, 0x004E4942))
+        for chunk in _chunks(vertices):
+            f.write(np.ascontiguousarray(chunk, dtype='<f4').tobytes())
+        if faces is not None:
+            for chunk in _chunks(faces):
+                f.write(np.ascontiguousarray(chunk, dtype='<u4').tobytes())
+    os.replace(temporary, path)
+
+
+def export(path, vertices, faces=None):
+    # Writes a point cloud or mesh in the format of the extension of path, .ply, .stl or .glb
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.ply':
+        write_ply(path, vertices, faces)
+    elif extension == '.glb':
+        write_glb(path, vertices, faces)
+    elif extension == '.stl':
+        if faces is None:
+            raise ValueError('STL holds meshes only')
+        write_stl(path, vertices, faces)
+    else:
+        raise ValueError("Unknown format %r, expected '.ply', '.stl' or '.glb'" % extension)
+
+#######################################################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports a Mandelbulb mesh, or with --cloud its point cloud, to a '
+                                                 'binary PLY, STL or glTF (.glb) file.')
+    parser.add_argument('path')
+    parser.add_argument('--cloud', action='store_true', help='export the point cloud of six views')
+    parser.add_argument('--degree', type=int, default=8)
+    parser.add_argument('--resolution', type=int, default=256, help='mesh lattice cells, or cloud rays per side')
+    parser.add_argument('--weld', type=float, default=None, help='merge vertices within this distance')
+    parser.add_argument('--decimate', type=float, default=None, help='cluster mesh vertices in cubes of this side')
+    args = parser.parse_args()
+
+    if args.cloud:
+        vertices, _ = capture([[3, 0, 0], [0, 3, 0], [0, 0, 3], [-3, 0, 0], [0, -3, 0], [0, 0, -3]],
+                              width=args.resolution, height=args.resolution, degree=args.degree)
+        faces = None
+    else:
+        vertices, faces = extract_mesh(args.resolution, degree=args.degree)
+    if args.weld is not None:
+        vertices, faces = weld(vertices, faces, args.weld)
+    if args.decimate is not None and faces is not None:
+        vertices, faces = decimate(vertices, faces, args.decimate)
+    export(args.path, vertices, faces)
+    print('%d vertices, %d faces' % (len(vertices), 0 if faces is None else len(faces)))
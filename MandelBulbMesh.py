@@ -0,0 +1,117 @@
+import numpy as np
+from skimage import measure
+
+from MandelBulbEngine import lattice_distances, bounding_radius
+
+# Meshes are extracted from the distance estimate, which is negative inside the bulb, on a lattice
+# of RESOLUTION cells per side over the bounding cube. Only the narrow band around the surface is
+# sampled: starting from the whole cube, blocks are split in eight and a child is dropped when the
+# estimate at its center exceeds BAND_SAFETY times its half diagonal in magnitude, down to blocks
+# of BAND_BLOCK cells. Marching cubes runs on chunks of CHUNK cells, CHUNKS_PER_BATCH chunks being
+# sampled at a time, in which the lattice points of dropped blocks take the estimate at the center
+# of their block, which has the sign of the whole block.
+RESOLUTION = 256
+CHUNK = 16
+BAND_BLOCK = 4
+BAND_SAFETY = 1.5
+CHUNKS_PER_BATCH = 256
+
+#######################################################################################################################
+
+
+def _in_band(distance, size, spacing):
+    # NaN at the origin, where the estimate is 0 * log(0), keeps the block
+    return ~(np.abs(distance) > BAND_SAFETY * np.sqrt(3) / 2 * size * spacing)
+
+
+def _band_chunks(cells, origin, spacing, chunk, iterations, degree, bailout):
+    # Lattice indices of the lowest corner of the chunks near the surface, and the number of
+    # distance estimates spent finding them
+    blocks = np.zeros((1, 3), dtype=np.int64)
+    children = np.indices((2, 2, 2)).reshape(3, -1).T
+    size = cells
+    samples = 0
+    while size > chunk:
+        size //= 2
+        blocks = (blocks[:, np.newaxis, :] + size * children).reshape(-1, 3)
+        distance = lattice_distances(blocks + size // 2, origin, spacing, iterations, degree, bailout)
+        samples += blocks.shape[0]
+        blocks = blocks[_in_band(distance, size, spacing)]
+    return blocks, samples
+
+
+def _chunk_fields(corners, origin, spacing, chunk, iterations, degree, bailout):
+    # Distance estimates at the (chunk + 1)**3 lattice points of every chunk, evaluated only around
+    # the BAND_BLOCK blocks in the band, and the number of estimates evaluated
+    block = min(BAND_BLOCK, chunk)
+    blocks = chunk // block
+    centers = (corners[:, np.newaxis, :] + block * np.indices((blocks,) * 3).reshape(3, -1).T + block // 2)
+    distance = lattice_distances(centers.reshape(-1, 3), origin, spacing, iterations, degree, bailout)
+    distance = distance.reshape((-1,) + (blocks,) * 3)
+    active = _in_band(distance, block, spacing)
+
+    # Block of every lattice point, the last point of each axis belongs to the last block
+    owner = np.minimum(np.arange(chunk + 1) // block, blocks - 1)
+    fields = distance[:, owner][:, :, owner][:, :, :, owner]
+    # A lattice point is evaluated when any of the cells around it lies in an active block
+    cells = active[:, owner[:-1]][:, :, owner[:-1]][:, :, :, owner[:-1]]
+    cells = np.pad(cells, [(0, 0), (1, 1), (1, 1), (1, 1)])
+    evaluate = np.zeros(fields.shape, dtype=np.bool_)
+    for i in (0, 1):
+        for j in (0, 1):
+            for k in (0, 1):
+                evaluate |= cells[:, i:i + chunk + 1, j:j + chunk + 1, k:k + chunk + 1]
+
+    chunk_index, i, j, k = np.nonzero(evaluate)
+    indices = corners[chunk_index] + np.stack([i, j, k], axis=1)
+    fields[evaluate] = lattice_distances(indices, origin, spacing, iterations, degree, bailout)
+    return np.nan_to_num(fields, nan=-spacing), centers.shape[0] * centers.shape[1] + indices.shape[0]
+
+
+def extract_mesh(resolution=RESOLUTION, iterations=32, degree=8, bailout=32000, level=0.0, radius=None, chunk=CHUNK,
+                 profile=False):
+    # Triangle mesh of the surface where the distance estimate crosses level, as the (n, 3)
+    # vertices and (m, 3) vertex indices of the faces, go.Mesh3d's x, y, z and i, j, k. The
+    # resolution is rounded up to chunk times a power of two. Vertices shared by neighbouring
+    # chunks are welded. With profile the number of distance estimates evaluated is returned third,
+    # against (resolution + 1)**3 for the full lattice.
+    radius = bounding_radius(degree) if radius is None else radius
+    cells = chunk * 2**max(0, int(np.ceil(np.log2(resolution / chunk))))
+    spacing = 2 * radius / cells
+    origin = -radius
+
+    blocks, samples = _band_chunks(cells, origin, spacing, chunk, iterations, degree, bailout)
+    vertices, faces = [], []
+    count = 0
+    for first in range(0, blocks.shape[0], CHUNKS_PER_BATCH):
+        batch = blocks[first:first + CHUNKS_PER_BATCH]
+        fields, evaluated = _chunk_fields(batch, origin, spacing, chunk, iterations, degree, bailout)
+        samples += evaluated
+        for corner, field in zip(batch, fields):
+            if not field.min() < level < field.max():
+                continue
+            chunk_vertices, chunk_faces, _, _ = measure.marching_cubes(field, level)
+            vertices.append(chunk_vertices + corner)
+            faces.append(chunk_faces + count)
+            count += chunk_vertices.shape[0]
+
+    if not vertices:
+        mesh = np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    else:
+        # Every vertex lies on a lattice edge, named by its lower end and its axis. Neighbouring
+        # chunks interpolate the vertices of their shared edges from the same samples, so welding by
+        # edge merges exactly the duplicates.
+        vertices = np.concatenate(vertices)
+        lower = np.floor(vertices).astype(np.int64)
+        axis = np.argmax(vertices != lower, axis=1)
+        edges = ((lower[:, 0] * (cells + 1) + lower[:, 1]) * (cells + 1) + lower[:, 2]) * 3 + axis
+        _, unique, inverse = np.unique(edges, return_index=True, return_inverse=True)
+        vertices = vertices[unique]
+        faces = inverse.reshape(-1)[np.concatenate(faces)]
+        # Drops the faces that welding collapsed
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        mesh = vertices * spacing + origin, faces
+
+    if profile:
+        return mesh + (samples,)
+    return mesh
@@ -0,0 +1,121 @@
+import numpy as np
+
+# Point clouds are indexed by an octree over their bounding cube. Points are sorted along the Morton
+# (z-order) curve of a 2**MAX_DEPTH grid over the cube, so the points of every octree node are
+# contiguous, and every point gets the level of detail at which it first represents a node: the
+# shallowest depth at which it is the first point of its cell. Taking the points of level <= L
+# keeps one point per occupied cell of depth L. Points sharing their finest cell with an earlier
+# point get level MAX_DEPTH + 1.
+MAX_DEPTH = 16
+
+# Queries cull and refine the nodes of depth NODE_DEPTH, each of which keeps its points ordered by
+# level so that any level of detail of a node is a prefix of it
+NODE_DEPTH = 6
+
+#######################################################################################################################
+
+
+def morton_codes(cells):
+    # Interleaves the bits of the non-negative integer cell coordinates, up to 21 bits each
+    codes = np.zeros(cells.shape[0], dtype=np.int64)
+    for axis in range(3):
+        spread = cells[:, axis].astype(np.int64) & 0x1fffff
+        spread = (spread | spread << 32) & 0x1f00000000ffff
+        spread = (spread | spread << 16) & 0x1f0000ff0000ff
+        spread = (spread | spread << 8) & 0x100f00f00f00f00f
+        spread = (spread | spread << 4) & 0x10c30c30c30c30c3
+        spread = (spread | spread << 2) & 0x1249249249249249
+        codes |= spread << (2 - axis)
+    return codes
+
+
+class PointOctree(object):
+
+    def __init__(self, points, max_depth=MAX_DEPTH, node_depth=NODE_DEPTH):
+        points = np.asarray(points)
+        self.max_depth = max_depth
+        self.node_depth = node_depth
+        self.levels = max_depth + 2
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        self.origin = lo
+        self.size = max(float(np.max(hi - lo)), np.finfo(float).tiny)
+
+        cells = np.clip(((points - lo) / self.size * 2**max_depth).astype(np.int64), 0, 2**max_depth - 1)
+        codes = morton_codes(cells)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+
+        level = np.full(codes.shape[0], max_depth + 1, dtype=np.uint8)
+        for depth in range(max_depth, -1, -1):
+            cell = codes >> 3 * (max_depth - depth)
+            first = np.empty(codes.shape[0], dtype=np.bool_)
+            first[:1] = True
+            first[1:] = cell[1:] != cell[:-1]
+            level[first] = depth
+
+        # Regroups every node by level, nodes stay in Morton order
+        node = codes >> 3 * (max_depth - node_depth)
+        regroup = np.lexsort((level, node))
+        self.points = points[order[regroup]]
+        self.level = level[regroup]
+        node = node[regroup]
+
+        self.starts = np.flatnonzero(np.r_[True, node[1:] != node[:-1]])
+        index = np.repeat(np.arange(self.starts.shape[0]), np.diff(np.r_[self.starts, node.shape[0]]))
+        # counts[i, L] is the number of points of node i of level <= L
+        counts = np.zeros((self.starts.shape[0], self.levels), dtype=np.int64)
+        np.add.at(counts, (index, self.level), 1)
+        self.counts = counts.cumsum(axis=1)
+
+        lower = np.minimum.reduceat(self.points, self.starts)
+        upper = np.maximum.reduceat(self.points, self.starts)
+        self.centers = (lower + upper) / 2
+        self.radii = np.linalg.norm(upper - lower, axis=1) / 2
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def node_levels(self, eye, forward, field_of_view, detail):
+        # Level of detail of every node for a camera at eye looking along forward, whose view fits in
+        # a cone of the given full angle. Visible nodes get cells of about 1 / detail of their
+        # distance, nodes outside the view keep their first point.
+        offset = self.centers - eye
+        distance = np.linalg.norm(offset, axis=1)
+        inside = distance <= self.radii
+        cosine = offset @ forward / np.maximum(distance, np.finfo(float).tiny)
+        spread = np.arcsin(np.clip(self.radii / np.maximum(distance, np.finfo(float).tiny), 0, 1))
+        visible = inside | (np.arccos(np.clip(cosine, -1, 1)) - spread <= field_of_view / 2)
+
+        cell = np.maximum(distance - self.radii, self.size / 2**self.max_depth) / detail
+        level = np.ceil(np.log2(self.size / cell))
+        level = np.clip(level, self.node_depth, self.levels - 1).astype(np.int64)
+        level[~visible] = self.node_depth
+        return level
+
+    def query(self, eye, forward, field_of_view=np.pi / 4, budget=200000):
+        # Points seen from eye with the finest detail (see node_levels) that fits in budget points,
+        # found by bisection. Returns at least one point per node however small the budget.
+        eye = np.asarray(eye, dtype=np.float64)
+        forward = np.asarray(forward, dtype=np.float64)
+        forward = forward / np.linalg.norm(forward)
+        nodes = np.arange(self.starts.shape[0])
+
+        def total(detail):
+            return self.counts[nodes, self.node_levels(eye, forward, field_of_view, detail)].sum()
+
+        # Details are bisected on a log scale, at 1 every visible node is as coarse as it gets
+        lo, hi = 0.0, float(self.levels + 8)
+        if total(2**hi) <= budget:
+            lo = hi
+        else:
+            for _ in range(20):
+                mid = (lo + hi) / 2
+                if total(2**mid) <= budget:
+                    lo = mid
+                else:
+                    hi = mid
+
+        counts = self.counts[nodes, self.node_levels(eye, forward, field_of_view, 2**lo)]
+        ends = np.cumsum(counts)
+        index = np.arange(ends[-1]) + np.repeat(self.starts - (ends - counts), counts)
+        return self.points[index]
@@ -0,0 +1,101 @@
+import threading
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Output, Input
+from dash.exceptions import PreventUpdate
+
+import plotly.graph_objs as go
+import numpy as np
+
+from MandelBulbEngine import capture
+from MandelBulbOctree import PointOctree
+
+app = dash.Dash()
+
+#######################################################################################################################
+
+# The cloud is captured from OBSERVERS at CAPTURE_SIZE x CAPTURE_SIZE rays each and indexed in a
+# PointOctree. Every camera move sends the browser the level of detail of the cloud that fits in
+# POINT_BUDGET points, finest near the camera and inside its view.
+DEGREE = 8
+OBSERVERS = [[3, 0, 0], [0, 3, 0], [0, 0, 3], [-3, 0, 0], [0, -3, 0], [0, 0, -3]]
+CAPTURE_SIZE = 1000
+POINT_BUDGET = 200000
+
+# The axes are fixed to +-SCENE_RANGE with a cube aspect, so that plotly's camera coordinates, in
+# which the scene box spans +-0.5, are the data coordinates over 2 * SCENE_RANGE
+SCENE_RANGE = 1.25
+FIELD_OF_VIEW = np.pi / 4
+DEFAULT_CAMERA = {'eye': {'x': 1.25, 'y': 1.25, 'z': 1.25}, 'center': {'x': 0, 'y': 0, 'z': 0}}
+SIZE = 1000
+
+_octree = None
+_octree_lock = threading.Lock()
+
+
+def get_octree():
+    # Captured by the first request rather than at import, like the MandelBrot app
+    global _octree
+    with _octree_lock:
+        if _octree is None:
+            points, _ = capture(OBSERVERS, width=CAPTURE_SIZE, height=CAPTURE_SIZE, degree=DEGREE)
+            _octree = PointOctree(points)
+    return _octree
+
+
+def camera_view(camera):
+    # Eye position and viewing direction of a plotly scene camera in data coordinates
+    eye = np.array([camera['eye'][axis] for axis in 'xyz'], dtype=np.float64)
+    center = np.array([camera.get('center', DEFAULT_CAMERA['center'])[axis] for axis in 'xyz'], dtype=np.float64)
+    return eye * 2 * SCENE_RANGE, (center - eye) * 2 * SCENE_RANGE
+
+
+def make_figure(points):
+    axis = dict(range=[-SCENE_RANGE, SCENE_RANGE], autorange=False)
+    bulb = go.Scatter3d(x=points[:, 0],
+                        y=points[:, 1],
+                        z=points[:, 2],
+                        mode='markers',
+                        marker=dict(size=1,
+                                    color=np.sqrt(np.sum(points ** 2, axis=1)),
+                                    colorscale='Viridis',
+                                    ),
+                        opacity=.7,
+                        )
+    layout = go.Layout(
+        title='MandelBulb Point Cloud',
+        width=SIZE,
+        height=SIZE,
+        # Keeps the camera of the user when the points are replaced
+        uirevision='bulb',
+        scene=dict(xaxis=axis, yaxis=axis, zaxis=axis, aspectmode='cube', camera=DEFAULT_CAMERA),
+    )
+    return go.Figure(data=[bulb], layout=layout)
+
+#######################################################################################################################
+
+
+app.layout = html.Div([
+    dcc.Graph(
+        id='bulb',
+        figure=make_figure(np.empty((0, 3)))
+    ),
+])
+
+
+@app.callback(
+    Output('bulb', 'figure'),
+    [Input('bulb', 'relayoutData')])
+def display_points(relayoutData):
+    if relayoutData and 'scene.camera' not in relayoutData:
+        raise PreventUpdate
+    camera = (relayoutData or {}).get('scene.camera', DEFAULT_CAMERA)
+    eye, forward = camera_view(camera)
+    points = get_octree().query(eye, forward, field_of_view=FIELD_OF_VIEW, budget=POINT_BUDGET)
+    return make_figure(points)
+
+
+if __name__ == '__main__':
+    app.run_server(debug=True)
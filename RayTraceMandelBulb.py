@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-from numba import jit
+from MandelBulbEngine import march
 import plotly
 from plotly.offline import init_notebook_mode
 init_notebook_mode(connected=True)
@@ -33,45 +33,9 @@ def get_plane_points(Q, center, span, zoom, width, height, eps=1e-4):
     return P
 
 
-@jit
-def DistanceEstimator(positions, iterations, degree=8, bailout=1000):
-    m = positions.shape[0]
-    x, y, z = np.zeros(m), np.zeros(m), np.zeros(m)
-    x0, y0, z0 = positions[:, 0], positions[:, 1], positions[:, 2]
-    dr = np.zeros(m) + 1
-    r = np.zeros(m)
-    theta = np.zeros(m)
-    phi = np.zeros(m)
-    zr = np.zeros(m)
-    for _ in range(iterations):
-        r = np.sqrt(x*x + y*y + z*z)
-        idx1 = r < bailout
-        dr[idx1] = np.power(r[idx1], degree - 1) * degree * dr[idx1] + 1.0
-
-        theta[idx1] = np.arctan2(np.sqrt(x[idx1]*x[idx1] + y[idx1]*y[idx1]), z[idx1])
-        phi[idx1] = np.arctan2(y[idx1], x[idx1])
-
-        zr[idx1] = r[idx1] ** degree
-        theta[idx1] = theta[idx1] * degree
-        phi[idx1] = phi[idx1] * degree
-
-        x[idx1] = zr[idx1] * np.sin(theta[idx1]) * np.cos(phi[idx1]) + x0[idx1]
-        y[idx1] = zr[idx1] * np.sin(theta[idx1]) * np.sin(phi[idx1]) + y0[idx1]
-        z[idx1] = zr[idx1] * np.cos(theta[idx1]) + z0[idx1]
-
-    return 0.5 * np.log(r) * r / dr
-
-
 def trace(start, directions, max_steps, min_distance, iterations, degree, bailout, power):
-    total_distance = np.zeros(directions.shape[0])
-    keep_iterations = np.ones_like(total_distance)
-    steps = np.zeros_like(total_distance)
-    for _ in range(max_steps):
-        positions = start[np.newaxis, :] + total_distance[:, np.newaxis] * directions
-        distance = DistanceEstimator(positions, iterations, degree, bailout)
-        keep_iterations[distance < min_distance] = 0
-        total_distance += distance * keep_iterations
-        steps += keep_iterations
+    # Every ray is marched in one compiled pass, see MandelBulbEngine.march
+    total_distance, steps, _ = march(start, directions, max_steps, min_distance, iterations, degree, bailout)
     return 1 - (steps/max_steps)**power
 
 
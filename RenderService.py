@@ -0,0 +1,219 @@
+import hashlib
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from MandelBrotEngine import RenderCancelled
+
+# Sessions whose last request is older than this are forgotten
+SESSION_TTL = 30 * 60
+
+# Directory of the session state shared by every server process on the machine, so that under
+# several gunicorn workers a request submitted to one worker cancels the render of the same
+# session running in another and a poll reaching any worker gets the newest result. An empty
+# MANDELBROT_RENDER_DIR keeps the state in the memory of the process, which is only correct with a
+# single server process or with sessions routed to one worker each.
+RENDER_DIR = os.environ.get('MANDELBROT_RENDER_DIR', os.path.join(tempfile.gettempdir(), 'mandelbrot-renders'))
+
+
+class RenderJob(object):
+    # One render request. A job is cancelled as soon as a newer job is submitted for its session,
+    # renders poll is_cancelled() and give up by raising RenderCancelled.
+
+    def __init__(self, service, session, generation, params):
+        self.service = service
+        self.session = session
+        self.generation = generation
+        self.params = params
+        self.published = 0
+
+    def is_cancelled(self):
+        return self.service.latest_generation(self.session) != self.generation
+
+    def publish(self, result, done=False):
+        self.published += 1
+        self.service._publish(self, result, done)
+
+
+class MemorySessions(object):
+    # Session state in the memory of the process: the newest generation of every session, its
+    # latest result as (generation, sequence, result, done) and the (generation, sequence) of the
+    # last result delivered
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._results = {}
+        self._delivered = {}
+        self._touched = {}
+
+    def set_latest(self, session, generation):
+        with self._lock:
+            self._latest[session] = generation
+            self._touched[session] = time.time()
+
+    def latest(self, session):
+        return self._latest.get(session)
+
+    def put_result(self, session, entry):
+        with self._lock:
+            if self._latest.get(session) == entry[0]:
+                self._results[session] = entry
+
+    def get_result(self, session):
+        return self._results.get(session)
+
+    def deliver(self, session, entry):
+        # True if entry was not delivered before, which it is from now on
+        with self._lock:
+            if self._delivered.get(session) == entry[:2]:
+                return False
+            self._delivered[session] = entry[:2]
+            return True
+
+    def expire(self, now):
+        with self._lock:
+            for session, touched in list(self._touched.items()):
+                if now - touched > SESSION_TTL:
+                    for table in (self._latest, self._results, self._delivered, self._touched):
+                        table.pop(session, None)
+
+
+class DirectorySessions(object):
+    # The state of MemorySessions kept in one directory per session, named by a hash of it, holding
+    # the files latest, result and delivered. Files are written to a temporary name and renamed into
+    # place like the tiles of TileStore, readers see whole files or none. Two workers polling at
+    # once may both deliver the same result, which the page shows twice.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._expired = 0.0
+
+    def _path(self, session, name):
+        return os.path.join(self.directory, hashlib.sha1(session.encode()).hexdigest(), name)
+
+    def _write(self, path, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set_latest(self, session, generation):
+        self._write(self._path(session, 'latest'), generation)
+
+    def latest(self, session):
+        return self._read(self._path(session, 'latest'))
+
+    def put_result(self, session, entry):
+        if self.latest(session) == entry[0]:
+            self._write(self._path(session, 'result'), entry)
+
+    def get_result(self, session):
+        return self._read(self._path(session, 'result'))
+
+    def deliver(self, session, entry):
+        path = self._path(session, 'delivered')
+        if self._read(path) == entry[:2]:
+            return False
+        self._write(path, entry[:2])
+        return True
+
+    def expire(self, now):
+        # Walks the directory at most once a minute per process
+        if now - self._expired < 60:
+            return
+        self._expired = now
+        try:
+            sessions = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in sessions:
+            try:
+                touched = os.stat(os.path.join(self.directory, name, 'latest')).st_mtime
+            except OSError:
+                continue
+            if now - touched > SESSION_TTL:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+class RenderService(object):
+    # Render queue served by a few daemon threads of the process. Only the newest request of every
+    # session is rendered, stale ones are dropped from the queue or interrupted while running, and
+    # results are picked up by polling. Session state lives in sessions, by default shared through
+    # RENDER_DIR with the other server processes, so a session may submit and poll through any of
+    # them. Jobs are only ever rendered by the process they were submitted to.
+
+    def __init__(self, render, threads=2, sessions=None):
+        self._render = render
+        self._threads = threads
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        if sessions is None:
+            sessions = DirectorySessions(RENDER_DIR) if RENDER_DIR else MemorySessions()
+        self.sessions = sessions
+
+    def _start(self):
+        for _ in range(self._threads):
+            worker = threading.Thread(target=self._run, name='render-worker')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job.is_cancelled():
+                continue
+            try:
+                job.publish(self._render(job), done=True)
+            except RenderCancelled:
+                pass
+            except Exception as error:
+                job.publish(error, done=True)
+
+    def _publish(self, job, result, done):
+        self.sessions.put_result(job.session, (job.generation, job.published, result, done))
+
+    def latest_generation(self, session):
+        return self.sessions.latest(session)
+
+    def submit(self, session, params):
+        # Generations are unique across processes, a job is cancelled once the latest generation of
+        # its session is another one
+        with self._lock:
+            if not self._workers:
+                self._start()
+        self.sessions.expire(time.time())
+        generation = uuid.uuid4().hex
+        self.sessions.set_latest(session, generation)
+        self._queue.put(RenderJob(self, session, generation, params))
+        return generation
+
+    def poll(self, session):
+        # Returns (result, done) for a result of the newest job of the session not returned before,
+        # or None. Failed renders are re-raised here.
+        entry = self.sessions.get_result(session)
+        if entry is None or entry[0] != self.sessions.latest(session) or not self.sessions.deliver(session, entry):
+            return None
+        generation, _, result, done = entry
+        if isinstance(result, Exception):
+            raise result
+        return result, done
@@ -0,0 +1,50 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Measures how long a fresh server process takes to import the app and to render the home view,
+# each run in a new interpreter like a restarted worker. The first run fills numba's on-disk cache
+# if it is empty, later runs show the warm start. Exits with status 1 when a warm run is slower
+# than --budget seconds.
+
+PROBE = """
+import time
+started = time.perf_counter()
+import MandelBrot
+imported = time.perf_counter()
+MandelBrot.make_figure(*MandelBrot.render_view(*MandelBrot.HOME_VIEW))
+rendered = time.perf_counter()
+print(imported - started, rendered - imported)
+"""
+
+#######################################################################################################################
+
+
+def measure(mode):
+    # The tile store is disabled so that the render measures the kernels and not a disk read
+    env = dict(os.environ, MANDELBROT_TILE_STORE='')
+    code = PROBE.replace('import MandelBrot\n', 'import MandelBrot\nMandelBrot.RENDER_MODE = %r\n' % mode, 1)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    imported, rendered = output.split()[-2:]
+    return float(imported), float(rendered)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--mode', default='direct', help="RENDER_MODE of the app, 'direct' or 'tiles'")
+    parser.add_argument('--budget', type=float, default=None, help='seconds allowed for import plus first render')
+    args = parser.parse_args()
+
+    worst = 0.0
+    for run in range(args.runs):
+        imported, rendered = measure(args.mode)
+        print('run %d: import %.2fs, first render %.2fs' % (run + 1, imported, rendered))
+        if run > 0:
+            worst = max(worst, imported + rendered)
+
+    if args.budget is not None and worst > args.budget:
+        print('warm start took %.2fs, over the budget of %.2fs' % (worst, args.budget))
+        sys.exit(1)
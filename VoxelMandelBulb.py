@@ -2,8 +2,8 @@ import numpy as np
 import plotly.graph_objs as go
 import plotly.figure_factory as ff
 from plotly import offline
-import pandas as pd
 import math
+from MandelBulbEngine import voxel_counts, orbit_density
 import random
 from functools import reduce
 from skimage import measure
@@ -15,9 +15,9 @@ import matplotlib.tri as mtri
 
 offline.init_notebook_mode(connected=True)
 
-x_res = 35  # 30
-y_res = 35
-z_res = 35
+x_res = 64  # 30
+y_res = 64
+z_res = 64
 n = 4
 
 # drawing area (xa < xb & ya < yb)
@@ -28,94 +28,25 @@ yb = 1.5
 za = -1.5
 zb = 1.5
 
-maxIt = 256  # max number of iterations allowed
+maxIt = 255  # max number of iterations allowed, escape counts then fit in uint8
 pi2 = math.pi * 2.0
 # random rotation angles to convert 2d plane to 3d plane
 xy = random.random() * pi2
 xz = random.random() * pi2
 yz = random.random() * pi2
 
-sxy = math.sin(xy)
-cxy = math.cos(xy)
-sxz = math.sin(xz)
-cxz = math.cos(xz)
-syz = math.sin(yz)
-cyz = math.cos(yz)
+# Every lattice point is rotated and iterated in one compiled parallel pass, see
+# MandelBulbEngine.voxel_counts. Points within .5 of the origin are inside the bulb. Pass path= to
+# compute grids larger than memory into an .npy memory map.
+r1, r2, r3, volume = voxel_counts(resolution=(x_res, y_res, z_res), bounds=((xa, xb), (ya, yb), (za, zb)),
+                                  degree=n, maxiter=maxIt, escape=3.5, angles=(xy, xz, yz), interior_radius=.5)
 
-xs = []
-ys = []
-zs = []
-
-origx = (xa + xb) / 2.0
-origy = (ya + yb) / 2.0
-origz = (za + zb) / 2.0
-for kz in range(z_res):
-
-    c = kz * (zb - za) / (z_res - 1) + za
-    # TODO: Choose "bounds" radially
-
-    for ky in range(y_res):
-
-        b = ky * (yb - ya) / (y_res - 1) + ya
-        for kx in range(x_res):
-
-            a = kx * (xb - xa) / (x_res - 1) + xa
-
-            # Ignore points inside bulb
-            if np.sqrt(a**2 + b**2 + c**2) < .5:
-                break
-
-            x = a
-            y = b
-            z = c
-
-            # 3d rotation around center of the plane
-            x = x - origx
-            y = y - origy
-
-            x0 = x * cxy - y * sxy
-            y = x * sxy + y * cxy
-            x = x0
-
-            # xy-plane rotation
-            x0 = x * cxz - z * sxz
-            z = x * sxz + z * cxz
-            x = x0
-
-            # xz-plane rotation
-            y0 = y * cyz - z * syz
-            z = y * syz + z * cyz
-            y = y0
-
-            # yz-plane rotation
-            x = x + origx
-            y = y + origy
-            z = z + origz
-
-            cx = x
-            cy = y
-            cz = z
-            for i in range(maxIt):
-                r = math.sqrt(x * x + y * y + z * z)
-                t = math.atan2(math.hypot(x, y), z)
-                p = math.atan2(y, x)
-                rn = r ** n
-                x = rn * math.sin(t * n) * math.cos(p * n) + cx
-                y = rn * math.sin(t * n) * math.sin(p * n) + cy
-                z = rn * math.cos(t * n) + cz
-                if x * x + y * y + z * z > 3.5:
-                    break
-
-                else:
-                    xs.append(x)
-                    ys.append(y)
-                    zs.append(z)
-
-print(pd.DataFrame({'x': xs, 'y': ys, 'z': zs}))
-
-xs = np.array(xs)
-ys = np.array(ys)
-zs = np.array(zs)
+# The voxels that never escape
+inside = np.nonzero(volume == maxIt)
+xs = r1[inside[0]]
+ys = r2[inside[1]]
+zs = r3[inside[2]]
+print(np.shape(xs))
 
 plot = go.Scatter3d(x=xs,
                     y=ys,
@@ -146,3 +77,27 @@ layout = go.Layout(
 
 fig = go.Figure(data=data, layout=layout)
 offline.plot(fig, filename='test.html', auto_open=True)
+
+# The orbits of the same points binned into a density_res^3 histogram as they are iterated, rather
+# than kept point by point, see MandelBulbEngine.orbit_density
+density_res = 64
+d1, d2, d3, density = orbit_density(resolution=(x_res, y_res, z_res), bounds=((xa, xb), (ya, yb), (za, zb)),
+                                    degree=n, maxiter=maxIt, escape=3.5, angles=(xy, xz, yz), interior_radius=.5,
+                                    bins=(density_res, density_res, density_res))
+print(density.sum())
+
+dx, dy, dz = np.meshgrid(d1, d2, d3, indexing='ij')
+log_density = np.log1p(density.astype(np.float64))
+volume_plot = go.Volume(x=dx.ravel(),
+                        y=dy.ravel(),
+                        z=dz.ravel(),
+                        value=log_density.ravel(),
+                        isomin=log_density.max() / 4,
+                        isomax=log_density.max(),
+                        opacity=.1,
+                        surface_count=12,
+                        colorscale='Viridis',
+                        )
+
+fig = go.Figure(data=[volume_plot], layout=layout)
+offline.plot(fig, filename='density.html', auto_open=True)
@@ -0,0 +1,56 @@
+from decimal import Decimal, localcontext
+
+import numpy as np
+import pytest
+
+from MandelBrotDeepZoom import deep_mandelbrot_set, reference_orbit, series_coefficients
+
+# A view of width 1e-13 in the seahorse valley, past float64 iteration
+CENTER = (Decimal('-0.743643887037151'), Decimal('0.131825904205330'))
+HALF_WIDTH = Decimal('5e-14')
+SIZE = 16
+MAXITER = 3000
+
+#######################################################################################################################
+
+
+def decimal_counts(xmin, xmax, ymin, ymax, maxiter, width, height, digits=50):
+    # Counts of mandelbrot() iterated in Decimal
+    with localcontext() as ctx:
+        ctx.prec = digits
+        n3 = np.zeros((width, height), dtype=np.int64)
+        for i in range(width):
+            cx = xmin + (xmax - xmin) * i / (width - 1)
+            for j in range(height):
+                cy = ymin + (ymax - ymin) * j / (height - 1)
+                x, y = cx, cy
+                for n in range(maxiter):
+                    if x*x + y*y > 4:
+                        n3[i, j] = n
+                        break
+                    x, y = x*x - y*y + cx, 2*x*y + cy
+    return n3
+
+
+def view():
+    return CENTER[0] - HALF_WIDTH, CENTER[0] + HALF_WIDTH, CENTER[1] - HALF_WIDTH, CENTER[1] + HALF_WIDTH
+
+
+def test_series_skips_iterations_here():
+    orbit = reference_orbit(CENTER[0], CENTER[1], MAXITER, 40)
+    skip, _ = series_coefficients(orbit, float(HALF_WIDTH) * 2**0.5)
+    assert skip > 500
+
+
+@pytest.mark.parametrize('series', [True, False])
+def test_deep_zoom_matches_decimal_iteration(series):
+    expected = decimal_counts(*view(), MAXITER, SIZE, SIZE)
+    _, _, n3 = deep_mandelbrot_set(*view(), maxiter=MAXITER, width=SIZE, height=SIZE, series=series)
+    np.testing.assert_array_equal(n3, expected)
+
+
+def test_series_keeps_pixels_that_escape_early():
+    # At the home view pixels escape within the iterations a series without bound check would skip
+    _, _, with_series = deep_mandelbrot_set(-2.0, 0.5, -1.25, 1.25, maxiter=250, width=120, height=120)
+    _, _, without = deep_mandelbrot_set(-2.0, 0.5, -1.25, 1.25, maxiter=250, width=120, height=120, series=False)
+    np.testing.assert_array_equal(with_series, without)
@@ -0,0 +1,166 @@
+import threading
+
+import numpy as np
+import pytest
+
+from MandelBrotEngine import (mandelbrot, mandelbrot_interior, mandelbrot_set, progressive_mandelbrot_set, julia_set,
+                              choose_precision, RenderCancelled, ReprojectedView, ResumableView)
+
+# Views over the main cardioid, the period-2 bulb, smaller bulbs, the boundary and the antenna on
+# the negative real axis. Odd sizes put samples exactly on the real axis.
+VIEWS = {
+    'home': (-2.0, 0.5, -1.25, 1.25),
+    'cardioid': (-0.5, 0.3, -0.4, 0.4),
+    'bulb': (-1.3, -0.7, -0.3, 0.3),
+    'cusp': (0.2, 0.3, -0.05, 0.05),
+    'seahorse': (-0.76, -0.72, 0.08, 0.12),
+    'antenna': (-2.0, -1.4, -0.02, 0.02),
+    'top bulb': (-0.2, 0.0, 0.6, 0.8),
+}
+
+#######################################################################################################################
+
+
+def scalar_counts(kernel, xmin, xmax, ymin, ymax, maxiter, width, height):
+    r1 = np.linspace(xmin, xmax, width)
+    r2 = np.linspace(ymin, ymax, height)
+    return np.array([[kernel(x + 1j*y, maxiter) for y in r2] for x in r1])
+
+
+@pytest.mark.parametrize('view', sorted(VIEWS))
+@pytest.mark.parametrize('maxiter', [50, 250, 1000])
+def test_interior_matches_plain_kernel(view, maxiter):
+    plain = scalar_counts(mandelbrot, *VIEWS[view], maxiter, 61, 41)
+    interior = scalar_counts(mandelbrot_interior, *VIEWS[view], maxiter, 61, 41)
+    np.testing.assert_array_equal(interior, plain)
+
+
+@pytest.mark.parametrize('view', sorted(VIEWS))
+def test_interior_checks_keep_mandelbrot_set(view):
+    _, _, plain = mandelbrot_set(*VIEWS[view], maxiter=500, width=301, height=201, interior_checks=False,
+                                 precision='complex')
+    _, _, interior = mandelbrot_set(*VIEWS[view], maxiter=500, width=301, height=201, interior_checks=True,
+                                    precision='complex')
+    np.testing.assert_array_equal(interior, plain)
+
+
+# Views without any interior pixel, subdivision can only fill exterior rectangles there
+EXTERIOR_VIEWS = {
+    'outside': (1.0, 3.0, 1.0, 3.0),
+    'filaments': (-1.95, -1.85, 0.05, 0.15),
+}
+
+
+@pytest.mark.parametrize('view', sorted(VIEWS) + sorted(EXTERIOR_VIEWS))
+@pytest.mark.parametrize('maxiter', [37, 250, 1000])
+@pytest.mark.parametrize('size', [(300, 300), (257, 131), (64, 301)])
+def test_subdivide_matches_brute(view, maxiter, size):
+    bounds = VIEWS.get(view) or EXTERIOR_VIEWS[view]
+    width, height = size
+    _, _, brute = mandelbrot_set(*bounds, maxiter=maxiter, width=width, height=height, method='brute',
+                                 precision='complex')
+    _, _, subdivided = mandelbrot_set(*bounds, maxiter=maxiter, width=width, height=height, method='subdivide')
+    np.testing.assert_array_equal(subdivided, brute)
+
+
+def test_subdivide_in_cancellable_row_groups():
+    _, _, brute = mandelbrot_set(*VIEWS['home'], maxiter=250, width=517, height=301, precision='complex')
+    _, _, subdivided = mandelbrot_set(*VIEWS['home'], maxiter=250, width=517, height=301, method='subdivide',
+                                      is_cancelled=lambda: False)
+    np.testing.assert_array_equal(subdivided, brute)
+
+
+@pytest.mark.parametrize('view', sorted(VIEWS) + sorted(EXTERIOR_VIEWS))
+@pytest.mark.parametrize('maxiter', [37, 250, 1000])
+@pytest.mark.parametrize('interior_checks', [True, False])
+def test_float64_matches_complex(view, maxiter, interior_checks):
+    bounds = VIEWS.get(view) or EXTERIOR_VIEWS[view]
+    _, _, reference = mandelbrot_set(*bounds, maxiter=maxiter, width=257, height=131, interior_checks=interior_checks,
+                                     precision='complex')
+    _, _, split = mandelbrot_set(*bounds, maxiter=maxiter, width=257, height=131, interior_checks=interior_checks,
+                                 precision='float64')
+    np.testing.assert_array_equal(split, reference)
+
+
+def test_default_precision_matches_complex():
+    # Deep enough that 'auto' would pick float64, and the home view where it would pick float32
+    for bounds in [(-0.7436447860, -0.7436387860, 0.1318228, 0.1318288), VIEWS['home']]:
+        _, _, reference = mandelbrot_set(*bounds, maxiter=500, width=300, height=300, precision='complex')
+        _, _, default = mandelbrot_set(*bounds, maxiter=500, width=300, height=300)
+        np.testing.assert_array_equal(default, reference)
+
+
+@pytest.mark.parametrize('size', [(300, 300), (1500, 1500), (301, 517)])
+def test_float32_differs_only_on_few_pixels(size):
+    # float32 is chosen by 'auto' on shallow views but never bit-identical where the boundary
+    # crosses them, its orbits drift from float64 near it
+    width, height = size
+    assert choose_precision(*VIEWS['home'], width, height) == 'float32'
+    _, _, reference = mandelbrot_set(*VIEWS['home'], maxiter=250, width=width, height=height, precision='complex')
+    _, _, auto = mandelbrot_set(*VIEWS['home'], maxiter=250, width=width, height=height, precision='auto')
+    assert np.mean(auto != reference) < 0.01
+
+
+@pytest.mark.parametrize('precision', ['complex', 'float64', 'float32', 'auto'])
+@pytest.mark.parametrize('interior_checks', [True, False])
+def test_progressive_last_pass_matches_mandelbrot_set(precision, interior_checks):
+    _, _, expected = mandelbrot_set(*VIEWS['home'], maxiter=250, width=301, height=203, interior_checks=interior_checks,
+                                    precision=precision)
+    passes = list(progressive_mandelbrot_set(*VIEWS['home'], maxiter=250, width=301, height=203,
+                                             interior_checks=interior_checks, precision=precision,
+                                             is_cancelled=lambda: False))
+    assert len(passes) == 4
+    np.testing.assert_array_equal(passes[-1][2], expected)
+
+
+@pytest.mark.parametrize('precision', ['complex', 'float64'])
+def test_reprojected_pan_matches_mandelbrot_set(precision):
+    view = ReprojectedView(width=301, height=203)
+    xmin, xmax, ymin, ymax = VIEWS['seahorse']
+    view.render(xmin, xmax, ymin, ymax, maxiter=500, precision=precision)
+    shift = 17.3 * (xmax - xmin) / 300
+    r1, r2, n3 = view.render(xmin + shift, xmax + shift, ymin, ymax, maxiter=500, precision=precision)
+    assert view.computed < 301 * 203 / 4
+    _, _, expected = mandelbrot_set(r1[0], r1[-1], r2[0], r2[-1], maxiter=500, width=301, height=203,
+                                    precision='complex')
+    np.testing.assert_array_equal(n3, expected)
+
+
+@pytest.mark.parametrize('c', [-0.8 + 0.156j, 0.285 + 0.01j, -0.12 + 0.75j, -1.0])
+def test_julia_float64_matches_complex(c):
+    _, _, reference = julia_set(c, maxiter=500, width=201, height=157, precision='complex')
+    _, _, split = julia_set(c, maxiter=500, width=201, height=157, precision='float64')
+    np.testing.assert_array_equal(split, reference)
+
+
+def test_resumable_view_continues_a_cancelled_render():
+    _, _, expected = mandelbrot_set(*VIEWS['home'], maxiter=800, width=301, height=203, precision='complex')
+    view = ResumableView(width=301, height=203)
+    view.render(*VIEWS['home'], maxiter=200)
+    # Cancelled after the first group of rows reached 800, the others stay at 200
+    checks = iter([False, True])
+    with pytest.raises(RenderCancelled):
+        view.render(*VIEWS['home'], maxiter=800, is_cancelled=lambda: next(checks))
+    assert view.reached.max() == 800 and view.reached.min() == 200
+    _, _, n3 = view.render(*VIEWS['home'], maxiter=800, is_cancelled=lambda: False)
+    np.testing.assert_array_equal(n3, expected)
+
+
+def test_concurrent_renders_match():
+    # Parallel kernels launched from several threads, as by the render service and the server
+    _, _, expected = mandelbrot_set(*VIEWS['seahorse'], maxiter=500, width=201, height=157)
+    results = []
+
+    def render():
+        for _ in range(3):
+            results.append(mandelbrot_set(*VIEWS['seahorse'], maxiter=500, width=201, height=157,
+                                          is_cancelled=lambda: False)[2])
+
+    threads = [threading.Thread(target=render) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 12
+    for n3 in results:
+        np.testing.assert_array_equal(n3, expected)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from MandelBulbEngine import DistanceEstimator, march, voxel_filter
+
+# Random points around the bulb. Inside it the orbits are chaotic and the estimators only agree
+# roughly, so the relative error is taken over the points at least OUTSIDE away from it.
+POSITIONS = np.random.default_rng(0).uniform(-1.3, 1.3, size=(20000, 3))
+OUTSIDE = 1e-3
+
+#######################################################################################################################
+
+
+def test_voxel_filter_keeps_far_apart_cells_apart():
+    # Cells 2**21 apart and more do not fit the packed keys, they must not collide
+    points = np.array([[0.0, 0.0, 0.0], [2.0**21, 0.0, 0.0], [0.0, 0.0, 0.5], [0.0, 2.0**22, 0.0], [2.0, 0.0, 0.0]])
+    np.testing.assert_array_equal(voxel_filter(points, 1.0), [0, 1, 3, 4])
+    np.testing.assert_array_equal(voxel_filter(points[[0, 2, 4]], 1.0), [0, 2])
+
+
+@pytest.mark.parametrize('degree', [8, 9])
+def test_distance_estimator_matches_trig_version(degree):
+    polynomial = DistanceEstimator(POSITIONS, 32, degree, 32000, False)
+    reference = DistanceEstimator(POSITIONS, 32, degree, 32000, True)
+    outside = reference > OUTSIDE
+    assert outside.sum() > len(POSITIONS) / 2
+    assert np.max(np.abs(polynomial[outside] - reference[outside]) / reference[outside]) < 1e-4
+
+
+def test_non_integer_degree_takes_trig_version():
+    np.testing.assert_array_equal(DistanceEstimator(POSITIONS, 32, 7.5, 32000, False),
+                                  DistanceEstimator(POSITIONS, 32, 7.5, 32000, True))
+
+
+def array_distance_estimator(positions, iterations, degree=8, bailout=1000):
+    # The array DistanceEstimator the MandelBulb scripts carried before MandelBulbEngine
+    m = positions.shape[0]
+    x, y, z = np.zeros(m), np.zeros(m), np.zeros(m)
+    x0, y0, z0 = positions[:, 0], positions[:, 1], positions[:, 2]
+    dr = np.zeros(m) + 1
+    r = np.zeros(m)
+    for _ in range(iterations):
+        r = np.sqrt(x*x + y*y + z*z)
+        idx1 = r < bailout
+        dr[idx1] = np.power(r[idx1], degree - 1) * degree * dr[idx1] + 1.0
+        theta = np.arctan2(np.sqrt(x[idx1]*x[idx1] + y[idx1]*y[idx1]), z[idx1]) * degree
+        phi = np.arctan2(y[idx1], x[idx1]) * degree
+        zr = r[idx1] ** degree
+        x[idx1] = zr * np.sin(theta) * np.cos(phi) + x0[idx1]
+        y[idx1] = zr * np.sin(theta) * np.sin(phi) + y0[idx1]
+        z[idx1] = zr * np.cos(theta) + z0[idx1]
+    return 0.5 * np.log(r) * r / dr
+
+
+def array_trace(start, directions, max_steps, min_distance, iterations, degree, bailout):
+    # The trace loop of the scripts before march, returning the distance travelled and the steps
+    total_distance = np.zeros(directions.shape[0])
+    keep_iterations = np.ones_like(total_distance)
+    steps = np.zeros_like(total_distance)
+    for _ in range(max_steps):
+        positions = start[np.newaxis, :] + total_distance[:, np.newaxis] * directions
+        distance = array_distance_estimator(positions, iterations, degree, bailout)
+        keep_iterations[distance < min_distance] = 0
+        total_distance += distance * keep_iterations
+        steps += keep_iterations
+    return total_distance, steps
+
+
+@pytest.mark.parametrize('method', ['fused', 'compact'])
+def test_unclipped_march_matches_array_trace(method):
+    # The 40 x 40 view of RayTraceMandelBulb
+    observer = np.array([1.0, 1.0, 3.0])
+    x, y = np.meshgrid(np.linspace(-1.2, 1.2, 40), np.linspace(-1.2, 1.2, 40))
+    x, y = x.reshape(-1), y.reshape(-1)
+    plane = np.vstack((x, y, -(observer[0]*x + observer[1]*y) / observer[2])).T
+    directions = plane - observer
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+
+    expected_distance, expected_steps = array_trace(observer, directions, 32, 5e-3, 32, 8, 32000)
+    total_distance, steps, hit = march(observer, directions, 32, 5e-3, 32, 8, 32000, radius=np.inf, method=method)
+    np.testing.assert_array_equal(steps, expected_steps)
+    np.testing.assert_allclose(total_distance, expected_distance, rtol=1e-9)
+    assert 0 < hit.sum() < len(hit)
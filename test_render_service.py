@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from MandelBrotEngine import RenderCancelled
+from RenderService import DirectorySessions, MemorySessions, RenderService
+
+#######################################################################################################################
+
+
+def wait_for(service, session, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = service.poll(session)
+        if result is not None and result[1]:
+            return result[0]
+        time.sleep(0.01)
+    raise AssertionError('no result')
+
+
+class Service(RenderService):
+    # Renders its params once their event is set, polling is_cancelled like the engine does
+    # between row groups
+
+    def __init__(self, sessions):
+        RenderService.__init__(self, self._slow, threads=1, sessions=sessions)
+        self.cancelled = []
+
+    def _slow(self, job):
+        params, release = job.params
+        while not release.wait(0.01):
+            if job.is_cancelled():
+                self.cancelled.append(params)
+                raise RenderCancelled()
+        return params
+
+
+@pytest.fixture(params=['memory', 'directory'])
+def workers(request, tmp_path):
+    # Two server processes sharing their session state, or one process with memory state
+    if request.param == 'memory':
+        sessions = MemorySessions()
+        return Service(sessions), Service(sessions)
+    return Service(DirectorySessions(str(tmp_path))), Service(DirectorySessions(str(tmp_path)))
+
+
+def test_newer_submit_to_another_worker_cancels_and_wins(workers):
+    a, b = workers
+    stale, newest = threading.Event(), threading.Event()
+    a.submit('session', ('stale', stale))
+    b.submit('session', ('newest', newest))
+    newest.set()
+    # Polls reaching either worker only ever see the newest result
+    assert wait_for(a, 'session') == 'newest'
+    deadline = time.time() + 10
+    while not a.cancelled and time.time() < deadline:
+        time.sleep(0.01)
+    assert a.cancelled == ['stale']
+    stale.set()
+    assert a.poll('session') is None and b.poll('session') is None
+
+
+def test_failed_render_is_raised_once(workers):
+    a, b = workers
+
+    def fail(job):
+        raise ValueError('broken')
+
+    a._render = fail
+    a.submit('session', None)
+    deadline = time.time() + 10
+    with pytest.raises(ValueError):
+        while time.time() < deadline:
+            b.poll('session')
+            time.sleep(0.01)
+    assert a.poll('session') is None
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import MandelBrotEngine
+from MandelBrotTiles import (TileCache, TileStore, compute_tile, get_tile, render_tiles, render_tiles_progressive,
+                             tile_key, tile_level, tile_passes, BASE_SPAN, TILE_SIZE)
+
+VIEWS = [(-2.0, 0.5, -1.25, 1.25), (-0.76, -0.72, 0.08, 0.12)]
+
+#######################################################################################################################
+
+
+@pytest.mark.parametrize('view', VIEWS)
+def test_progressive_tiles_match_direct_tiles(view):
+    _, _, direct = render_tiles(*view, maxiter=250, width=301, height=203, cache=TileCache(), store=None)
+    passes = list(render_tiles_progressive(*view, maxiter=250, width=301, height=203, cache=TileCache(), store=None))
+    np.testing.assert_array_equal(passes[-1][2], direct)
+
+
+def test_cache_serves_either_path_the_same_view():
+    # Tiles cached by the progressive path are then served to render_tiles and the other way around
+    def direct(cache):
+        return render_tiles(*VIEWS[0], maxiter=250, width=301, height=203, cache=cache, store=None)[2]
+
+    def progressive(cache):
+        return list(render_tiles_progressive(*VIEWS[0], maxiter=250, width=301, height=203, cache=cache,
+                                             store=None))[-1][2]
+
+    for first, second in [(progressive, direct), (direct, progressive)]:
+        cache = TileCache()
+        np.testing.assert_array_equal(first(cache), second(cache))
+        assert cache.hits > 0
+
+
+def test_tile_passes_end_with_the_tile():
+    *_, last = tile_passes(3, -3, 1, 250, strides=(8, 4, 2, 1))
+    np.testing.assert_array_equal(last, compute_tile(3, -3, 1, 250))
+
+
+def test_store_keeps_precisions_apart(tmp_path, monkeypatch):
+    store = TileStore(str(tmp_path))
+    key = tile_key(3, -3, 1, 250)
+    assert key[-1] == MandelBrotEngine.PRECISION
+    get_tile(3, -3, 1, 250, cache=TileCache(), store=store)
+    assert store.get(key) is not None
+
+    # With another precision the same tile is looked up under another name and recomputed
+    monkeypatch.setattr(MandelBrotEngine, 'PRECISION', 'complex')
+    other = tile_key(3, -3, 1, 250)
+    assert other[-1] == 'complex' and store.path(other) != store.path(key)
+    assert store.get(other) is None
+
+
+@pytest.mark.parametrize('spacing', [4.0 / 128 / 2**k * 1.37**j for k in range(1, 12) for j in range(-2, 3)])
+def test_tile_level_is_nearest(spacing):
+    # The tile spacing is within a factor sqrt(2) of the requested one
+    level = tile_level(spacing)
+    assert 2**-0.5 <= BASE_SPAN / 2**level / TILE_SIZE / spacing <= 2**0.5
+
+
+def test_cold_view_costs_about_its_pixels():
+    cache = TileCache()
+    render_tiles(*VIEWS[0], maxiter=250, width=1500, height=1500, cache=cache, store=None)
+    assert len(cache) * TILE_SIZE**2 < 1.1 * 1500**2
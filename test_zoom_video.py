@@ -0,0 +1,46 @@
+import numba
+import numpy as np
+
+from MandelBrotEngine import mandelbrot_set
+from MandelBrotZoomVideo import _init_worker, frame_views, keyframe, keyframe_groups, render_keyframe, resample
+
+KEYFRAMES = [(0, -0.75, 0.0, 3.5), (8, '-0.743643887037151', '0.131825904205330', 1e-3)]
+
+#######################################################################################################################
+
+
+def test_groups_cover_the_frames_in_order():
+    views = frame_views(KEYFRAMES, fps=30, width=192, height=108)
+    groups = keyframe_groups(views, 192, 108)
+    assert [first for first, _, _ in groups] == list(np.cumsum([0] + [count for _, count, _ in groups[:-1]]))
+    assert sum(count for _, count, _ in groups) == len(views)
+    # About four frames of samples per octave of zoom instead of one per frame
+    samples = sum(key[4] * key[5] for _, _, key in groups)
+    assert samples < 0.3 * len(views) * 192 * 108
+
+
+def test_finest_frame_of_a_group_is_its_own_render():
+    views = frame_views(KEYFRAMES, fps=30, width=192, height=108)
+    first, count, key = keyframe_groups(views, 192, 108)[1]
+    n3 = render_keyframe(key, maxiter=250)
+    finest = views[first + count - 1]
+    _, _, expected = mandelbrot_set(*map(float, finest), maxiter=250, width=192, height=108)
+    assert np.mean(resample(n3, key, finest, 192, 108) != expected) < 0.01
+
+
+def test_held_frames_share_one_keyframe_of_their_size():
+    views = frame_views([(0, -0.75, 0.0, 3.5), (1, -0.75, 0.0, 3.5)], fps=10, width=64, height=48)
+    groups = keyframe_groups(views, 64, 48)
+    assert len(groups) == 1 and groups[0][2][4:] == (64, 48)
+
+
+def test_keyframes_keep_the_worker_threads():
+    # Workers run with the numba threads set by _init_worker, not MandelBrotEngine.WORKERS
+    previous = numba.get_num_threads()
+    try:
+        _init_worker(1)
+        key = keyframe(frame_views(KEYFRAMES, fps=1, width=48, height=27)[:1], 48, 27)
+        render_keyframe(key, maxiter=100)
+        assert numba.get_num_threads() == 1
+    finally:
+        numba.set_num_threads(previous)